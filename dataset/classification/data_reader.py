@@ -3,6 +3,7 @@ import os
 import io
 import logging
 import numpy as np
+import torch
 import pickle
 from sklearn.model_selection import train_test_split
 from dataset.classification.data import data_gen,set_wordphase,create_dictionary,get_wordvec,get_index_batch
@@ -12,6 +13,9 @@ import preprocess
 from preprocess.dictionary import Dictionary
 from preprocess.bucketiterator import BucketIterator
 from preprocess.embedding import Embedding
+from preprocess.tokenized_split import TokenizedSplit, cache_key
+from preprocess.torch_dataset import SplitDataset, LengthBucketBatchSampler, ClassificationCollator
+from torch.utils.data import DataLoader
 from units import to_array
 
 class DataReader(object):
@@ -21,6 +25,13 @@ class DataReader(object):
         for key,value in opt.__dict__.items():
             self.__setattr__(key,value)  
         self.preprocessor = preprocess.setup(opt)
+        # raw data and preprocessing config, part of the key of the cached splits
+        self.data_key = cache_key(train, dev, test, [getattr(self.preprocessor, key, None) for key in
+                                  ['punct_remove_enable', 'word_seg_enable', 'word_seg_lang', 'word_stem_enable',
+                                   'word_lower_enable', 'stopword_remove_enable']])
+        self.tokenized = {}
+        self.loaders = {}
+        self.iterators = {}
         self.datas = {'train': self.preprocess(train), 'dev': self.preprocess(dev), 'test': self.preprocess(test)}
         self.nb_classes = nb_classes
         self.get_max_sentence_length()
@@ -70,7 +81,9 @@ class DataReader(object):
         for corpus in corpuses:
             for sentence in corpus['X']:    
                 tokens = sentence.lower().split()
-                for token in set(tokens):
+                # ids in order of first appearance, not of set(tokens), which
+                # changes with the string hash seed, as would the cache keys
+                for token in tokens:
                     dictionary.add(token)
         print("dictionary size = {}".format(len(dictionary.keys())))
         if not os.path.exists("temp"):
@@ -91,61 +104,83 @@ class DataReader(object):
          # print( x, x_mask)
         return x, x_mask
 
-    def get_train(self, shuffle=True, iterable=True, max_sequence_length=0):
-        x = self.datas['train']['X']
-        x = [self.embedding.text_to_sequence(sent) for sent in x]
-        y = to_categorical(np.asarray(self.datas['train']['y']))
-        data = (x,y)
+    def get_tokenized(self, split):
+        """
+        TokenizedSplit of split ('train', 'dev' or 'test'). It is tokenized
+        once and saved in temp/, keyed by the data, the preprocessing and the
+        dictionary, and later runs memory-map the saved arrays.
+        """
+        if split not in self.tokenized:
+            key = cache_key(self.data_key, sorted(self.dictionary.items()), self.embedding.max_sequence_length)
+            path = "temp/{}.{}.{}".format(self.dataset_name, split, key)
+            if TokenizedSplit.exists(path):
+                tokenized = TokenizedSplit.load(path)
+            else:
+                x = [self.embedding.text_to_sequence(sent) for sent in self.datas[split]['X']]
+                tokenized = TokenizedSplit.from_sequences(x, self.datas[split]['y'])
+                if not os.path.exists("temp"):
+                    os.mkdir("temp")
+                tokenized.save(path)
+            self.tokenized[split] = tokenized
+        return self.tokenized[split]
+
+    def get_split(self, split, iterable=True, max_sequence_length=0):
+        tokenized = self.get_tokenized(split)
         if max_sequence_length == 0:
             max_sequence_length = self.max_sequence_length
+        if iterable and self.__dict__.get('num_workers',0) > 0 and self.language == 'torch':
+            return self.get_loader(split, max_sequence_length=max_sequence_length)
         if iterable:
-            return BucketIterator(data,batch_size=self.batch_size,shuffle=True,max_sequence_length=max_sequence_length,backend = self.language)
+            # one iterator per split, so that its batch buffers are allocated once
+            key = (split, max_sequence_length)
+            if key not in self.iterators:
+                self.iterators[key] = BucketIterator(tokenized,batch_size=self.batch_size,shuffle=True,max_sequence_length=max_sequence_length,backend = self.language,
+                                                     bucket_size=self.__dict__.get('bucket_size',0),max_tokens=self.__dict__.get('max_tokens',0),
+                                                     dynamic_padding=self.__dict__.get('dynamic_padding',False),num_buffers=self.__dict__.get('batch_buffers',0))
+            return self.iterators[key]
         else: 
+            y = tokenized.onehot_labels()
             if self.bert_enabled:
-                x,x_mask = to_array(x,maxlen = self.max_sequence_length, use_mask = True)
+                x,x_mask = tokenized.to_array(maxlen = self.max_sequence_length, use_mask = True)
                 return [x,x_mask],y
             else:
-                x = to_array(x,maxlen = self.max_sequence_length, use_mask = False)
+                x = tokenized.to_array(maxlen = self.max_sequence_length, use_mask = False)
                 return x,y
-        
-        
-    def get_test(self, shuffle=True, iterable=True, max_sequence_length=0):
-        x = self.datas['test']['X']
-        x = [self.embedding.text_to_sequence(sent) for sent in x]
-        y = to_categorical(np.asarray(self.datas['test']['y']))
-        data = (x,y)
+
+    def get_loader(self, split, num_workers=None, max_sequence_length=0):
+        """
+        DataLoader over the TokenizedSplit of split, with the length bucketing
+        and padding options of get_split, loading the batches in num_workers
+        persistent worker processes (num_workers of the config by default).
+        The loader is built once per split and reused, so that its workers
+        are started once rather than on every call.
+        """
+        if num_workers is None:
+            num_workers = self.__dict__.get('num_workers',0)
         if max_sequence_length == 0:
             max_sequence_length = self.max_sequence_length
-        if iterable:
-            return BucketIterator(data,batch_size=self.batch_size,shuffle=True,max_sequence_length=max_sequence_length,backend = self.language)
-        else: 
-            if self.bert_enabled:
-                x,x_mask = to_array(x,maxlen = self.max_sequence_length, use_mask = True)
-                return [x,x_mask],y
-            else:
-                x = to_array(x,maxlen = self.max_sequence_length, use_mask = False)
-                return x,y
+        key = (split, num_workers, max_sequence_length)
+        if key not in self.loaders:
+            self.loaders[key] = self.build_loader(split, num_workers, max_sequence_length)
+        return self.loaders[key]
+
+    def build_loader(self, split, num_workers, max_sequence_length):
+        dataset = SplitDataset(self.get_tokenized(split))
+        sampler = LengthBucketBatchSampler(dataset.lengths(), self.batch_size, shuffle=True,
+                                           bucket_size=self.__dict__.get('bucket_size',0), max_tokens=self.__dict__.get('max_tokens',0),
+                                           max_sequence_length=max_sequence_length)
+        collate = ClassificationCollator(max_sequence_length, dynamic_padding=self.__dict__.get('dynamic_padding',False))
+        return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate, num_workers=num_workers,
+                          pin_memory=torch.cuda.is_available(), persistent_workers=num_workers > 0)
+
+    def get_train(self, shuffle=True, iterable=True, max_sequence_length=0):
+        return self.get_split('train', iterable=iterable, max_sequence_length=max_sequence_length)
         
+    def get_test(self, shuffle=True, iterable=True, max_sequence_length=0):
+        return self.get_split('test', iterable=iterable, max_sequence_length=max_sequence_length)
         
     def get_val(self,shuffle = True,iterable=True,max_sequence_length=0):
-        x = self.datas['dev']['X']
-        x = [self.embedding.text_to_sequence(sent) for sent in x]
-        y = to_categorical(np.asarray(self.datas['dev']['y']))
-        data = (x,y)
-        if max_sequence_length == 0:
-            max_sequence_length = self.max_sequence_length
-        if iterable:
-#            iterator = BucketIterator(data,batch_size=self.batch_size,shuffle=True,max_sequence_length=max_sequence_length)
-#            for batch in iterator:
-#                yield batch[0],batch[1]
-            return BucketIterator(data,batch_size=self.batch_size,shuffle=True,max_sequence_length=max_sequence_length,backend = self.language)
-        else: 
-            if self.bert_enabled:
-                x,x_mask = to_array(x,maxlen = self.max_sequence_length, use_mask = True)
-                return [x,x_mask],y
-            else:
-                x = to_array(x,maxlen = self.max_sequence_length, use_mask = False)
-                return x,y
+        return self.get_split('dev', iterable=iterable, max_sequence_length=max_sequence_length)
         
     
         
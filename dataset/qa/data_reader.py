@@ -20,6 +20,9 @@ from tools import evaluation
 from preprocess.dictionary import Dictionary
 from preprocess.embedding import Embedding
 from preprocess.bucketiterator import BucketIterator
+from preprocess.torch_dataset import QADataset, LengthBucketBatchSampler, QACollator
+import torch
+from torch.utils.data import DataLoader
 from keras.utils import to_categorical
 
 
@@ -368,6 +371,36 @@ class DataReader(object):
                 return [[to_array(i,self.max_sequence_length),to_array(i,self.max_sequence_length)] for i in zip(*samples)]
     
 
+    def get_loader(self, split, num_workers=None):
+        """
+        DataLoader over a QADataset of split, loading the batches in
+        num_workers persistent worker processes (num_workers of the config by
+        default). 'train' holds the (question, positive, negative) triples of
+        get_train, batched as pairwise or pointwise samples by match_type, and
+        'test' the labelled (question, answer) pairs of get_test, in the order of
+        self.datas['test'] so that evaluate scores the predictions row by row.
+        """
+        if num_workers is None:
+            num_workers = self.__dict__.get('num_workers',0)
+        if split == 'train':
+            dataset = QADataset.from_sequences(self.get_train(iterable = False)[:3])
+        else:
+            data = self.datas[split]
+            dataset = QADataset.from_sequences([[self.embedding.text_to_sequence(sent) for sent in data['question']],
+                                                [self.embedding.text_to_sequence(sent) for sent in data['answer']]],
+                                               data['flag'].values)
+        if split == 'train':
+            sampler = LengthBucketBatchSampler(dataset.lengths(), self.batch_size, shuffle=True,
+                                               bucket_size=self.__dict__.get('bucket_size',0), max_tokens=self.__dict__.get('max_tokens',0),
+                                               max_sequence_length=self.max_sequence_length)
+        else:
+            # sequential batches, the predictions are scored against the rows of self.datas[split]
+            sampler = LengthBucketBatchSampler(dataset.lengths(), self.batch_size, shuffle=False)
+        collate = QACollator(self.max_sequence_length, match_type=self.match_type,
+                             dynamic_padding=self.__dict__.get('dynamic_padding',False))
+        return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate, num_workers=num_workers,
+                          pin_memory=torch.cuda.is_available(), persistent_workers=num_workers > 0)
+
     def batch_gen(self, data_generator):
         if self.match_type == 'pointwise':
 #            self.unbalanced_sampling = False
@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
 
-from layers.complexnn.embedding import PhaseEmbedding, AmplitudeEmbedding, ComplexEmbedding
+from layers.complexnn.embedding import PhaseEmbedding, AmplitudeEmbedding, ComplexEmbedding, InterleavedComplexEmbedding, CachedComplexEmbedding, complex_embedding
 from layers.complexnn.multiply import ComplexMultiply
+from layers.complexnn.front_end import FrontEndFunction, ComplexFrontEnd
 from layers.complexnn.superposition import ComplexSuperposition
 from layers.complexnn.dense import ComplexDense
 from layers.complexnn.mixture import ComplexMixture
 from layers.complexnn.product import ComplexProduct
 from layers.complexnn.measurement import ComplexMeasurement
+from layers.complexnn.fused import MixtureMeasurementFunction, mixture_measurement
+from layers.complexnn.utils import to_complex, to_real_list, pack_hermitian, unpack_hermitian
 from layers.complexnn.concatenation import Concatenation
 from layers.complexnn.proj_measurement import ComplexProjMeasurement
 from layers.complexnn.index import Index
 from layers.complexnn.ngram import NGram
+from layers.complexnn.local_mixture import LocalMixture
 #from layers.pytorch.complexnn.projection import Complex1DProjection
 from layers.complexnn.l2_norm import L2Norm
 from layers.complexnn.l2_normalization import L2Normalization
@@ -4,13 +4,21 @@ import torch
 from torch.nn import Parameter, init
 import torch.nn.functional as F
 import math
+from layers.complexnn.utils import parameter_state
 
 class ComplexDense(torch.nn.Module):
-    def __init__(self, in_features, out_features, activation=None, bias=True):
+    '''
+    mode 'block' builds the (2*in_features, 2*out_features) block weight on
+    every call, 'cached' keeps it until the weights change and 'gauss' uses
+    Gauss's three real matmuls instead of the four in the block product.
+    '''
+    def __init__(self, in_features, out_features, activation=None, bias=True, mode='block'):
         super(ComplexDense, self).__init__()
         self.in_features = in_features
         self.out_features = out_features
         self.activation = activation
+        self.mode = mode
+        self._weight_cache = {}
         self.real_weight = Parameter(torch.Tensor(out_features, in_features))
         self.imag_weight = Parameter(torch.Tensor(out_features, in_features))
         if bias:
@@ -28,11 +36,46 @@ class ComplexDense(torch.nn.Module):
             init.uniform_(self.bias, -bound, bound)
 
     def forward(self, inputs):
+        if torch.is_tensor(inputs) and inputs.is_complex():
+            return self.complex_forward(inputs)
+
         real_input = inputs[0]
         imag_input = inputs[1]
 
+        if self.mode == 'gauss':
+            return self.gauss_forward(real_input, imag_input)
+
         inputs = torch.cat([real_input, imag_input], dim=1)
 
+        output = torch.matmul(inputs, self.get_weights())
+        # print(output.shape)
+        if self.bias is not None:
+            output = output + self.bias
+        if self.activation is not None:
+            output = self.activation(output)
+        return [output[:,:self.out_features], output[:,self.out_features:]]
+
+    def gauss_forward(self, real_input, imag_input):
+        # (a + ib)(c + id) = (k1 - k3) + i(k1 + k2) with k1 = c(a + b), k2 = a(d - c)
+        # and k3 = b(c + d), for the conjugate weight c + id = real_weight - i*imag_weight
+        real_weight, weight_difference, weight_sum = self.get_weights()
+        k1 = torch.matmul(real_input + imag_input, real_weight)
+        real_output = k1 - torch.matmul(imag_input, weight_sum)
+        imag_output = k1 + torch.matmul(real_input, weight_difference)
+        if self.bias is not None:
+            real_output = real_output + self.bias[:self.out_features]
+            imag_output = imag_output + self.bias[self.out_features:]
+        if self.activation is not None:
+            real_output = self.activation(real_output)
+            imag_output = self.activation(imag_output)
+        return [real_output, imag_output]
+
+    def build_weights(self):
+        if self.mode == 'gauss':
+            return [self.real_weight.t(),
+                    -(self.imag_weight + self.real_weight).t(),
+                    (self.real_weight - self.imag_weight).t()]
+
         cat_weights_4_real = torch.cat(
             [self.real_weight.t(), -self.imag_weight.t()],
             dim=1
@@ -46,18 +89,41 @@ class ComplexDense(torch.nn.Module):
             [cat_weights_4_real, cat_weights_4_imag],
             dim=0
         )
+        return cat_weights_4_complex
 
-        output = torch.matmul(inputs, cat_weights_4_complex)
-        # print(output.shape)
+    def get_weights(self):
+        """
+        build_weights, cached in the 'cached' and 'gauss' modes until the
+        weights change.
+        """
+        if self.mode == 'block':
+            return self.build_weights()
+        state = parameter_state(self, self.real_weight, self.imag_weight)
+        cached = self._weight_cache.get(self.mode)
+        if cached is None or cached[0] != state:
+            cached = (state, self.build_weights())
+            self._weight_cache[self.mode] = cached
+        return cached[1]
+
+    def __getstate__(self):
+        # the cached weights may hold an autograd graph, which cannot be copied
+        state = self.__dict__.copy()
+        state['_weight_cache'] = {}
+        return state
+
+    def complex_forward(self, inputs):
+        # the block matmul of forward multiplies by the conjugate weight
+        weight = torch.complex(self.real_weight, -self.imag_weight)
+        output = torch.matmul(inputs, weight.t())
         if self.bias is not None:
-            output = output + self.bias
+            output = output + torch.complex(self.bias[:self.out_features], self.bias[self.out_features:])
         if self.activation is not None:
-            output = self.activation(output)
-        return [output[:,:self.out_features], output[:,self.out_features:]]
+            output = torch.complex(self.activation(output.real), self.activation(output.imag))
+        return output
 
     def extra_repr(self):
-        return 'in_features={}, out_features={}, bias={}'.format(
-            self.in_features, self.out_features, self.bias is not None
+        return 'in_features={}, out_features={}, bias={}, mode={}'.format(
+            self.in_features, self.out_features, self.bias is not None, self.mode
         )
 
 def test():
@@ -70,5 +136,15 @@ def test():
     else:
         print('ComplexDense Test Failed.')
 
+    passed = True
+    for mode in ['cached', 'gauss']:
+        dense.mode = mode
+        mode_out = dense([a, b])
+        passed = passed and torch.allclose(out[0], mode_out[0], atol=1e-5) and torch.allclose(out[1], mode_out[1], atol=1e-5)
+    if passed:
+        print('ComplexDense Mode Test Passed.')
+    else:
+        print('ComplexDense Mode Test Failed.')
+
 if __name__ == '__main__':
     test()
\ No newline at end of file
@@ -3,6 +3,7 @@
 import math
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 
 def PhaseEmbedding(input_dim, embedding_dim):
@@ -30,13 +31,18 @@ def AmplitudeEmbedding(embedding_matrix, random_init=True):
 #                        _weight=torch.tensor(embedding_matrix, dtype=torch.float))
 
 class ComplexEmbedding(torch.nn.Module):
-    def __init__(self, opt, embedding_matrix, freeze=False):
+    '''
+    sparse=True gives the embedding weights row-sparse gradients, for
+    optimizer.RMSprop_Sparse.
+    '''
+    def __init__(self, opt, embedding_matrix, freeze=False, sparse=False):
         super(ComplexEmbedding, self).__init__()
+        self.sparse = sparse
         sign_matrix = torch.sign(embedding_matrix)
         amplitude_embedding_matrix = sign_matrix * embedding_matrix
-        self.amplitude_embed = nn.Embedding.from_pretrained(amplitude_embedding_matrix, freeze=freeze)
+        self.amplitude_embed = nn.Embedding.from_pretrained(amplitude_embedding_matrix, freeze=freeze, sparse=sparse)
         phase_embedding_matrix = math.pi * (1 - sign_matrix) / 2 # based on [0, 2*pi]
-        self.phase_embed = nn.Embedding.from_pretrained(phase_embedding_matrix, freeze=freeze)
+        self.phase_embed = nn.Embedding.from_pretrained(phase_embedding_matrix, freeze=freeze, sparse=sparse)
 
 
     def forward(self, indices):
@@ -44,7 +50,156 @@ class ComplexEmbedding(torch.nn.Module):
         phase_embed = self.phase_embed(indices)
 
         return [amplitude_embed, phase_embed]
+
+class InterleavedComplexEmbedding(torch.nn.Module):
+    '''
+    ComplexEmbedding with amplitudes and phases interleaved in one
+    (vocab_size, 2*embed_dim) parameter, so that a forward is one gather.
+    amplitude_weight and phase_weight are views of the two halves. The
+    state_dict keeps the amplitude_embed.weight and phase_embed.weight keys
+    of ComplexEmbedding, in both directions.
+    '''
+    def __init__(self, opt, embedding_matrix, freeze=False, sparse=False):
+        super(InterleavedComplexEmbedding, self).__init__()
+        self.sparse = sparse
+        self.embedding_dim = embedding_matrix.shape[1]
+        sign_matrix = torch.sign(embedding_matrix)
+        amplitude_embedding_matrix = sign_matrix * embedding_matrix
+        phase_embedding_matrix = math.pi * (1 - sign_matrix) / 2 # based on [0, 2*pi]
+        self.weight = nn.Parameter(torch.cat([amplitude_embedding_matrix, phase_embedding_matrix], dim=-1),
+                                   requires_grad=not freeze)
+
+    @property
+    def amplitude_weight(self):
+        return self.weight[:, :self.embedding_dim]
+
+    @property
+    def phase_weight(self):
+        return self.weight[:, self.embedding_dim:]
+
+    def forward(self, indices):
+        amplitude_embed, phase_embed = torch.chunk(F.embedding(indices, self.weight, sparse=self.sparse), 2, dim=-1)
+        return [amplitude_embed, phase_embed]
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        if keep_vars:
+            destination[prefix + 'amplitude_embed.weight'] = self.amplitude_weight
+            destination[prefix + 'phase_embed.weight'] = self.phase_weight
+        else:
+            destination[prefix + 'amplitude_embed.weight'] = self.amplitude_weight.detach().contiguous()
+            destination[prefix + 'phase_embed.weight'] = self.phase_weight.detach().contiguous()
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        keys = [prefix + 'amplitude_embed.weight', prefix + 'phase_embed.weight']
+        missing = [key for key in keys if key not in state_dict]
+        if len(missing) > 0:
+            if strict:
+                missing_keys.extend(missing)
+            return
+        weight = torch.cat([state_dict[key] for key in keys], dim=-1)
+        if weight.shape != self.weight.shape:
+            error_msgs.append('size mismatch for {}: copying a param with shape {} from checkpoint, '
+                              'the shape in current model is {}.'.format(prefix + 'weight', weight.shape, self.weight.shape))
+            return
+        with torch.no_grad():
+            self.weight.copy_(weight)
+
+class PhaseLookupFunction(torch.autograd.Function):
+    '''
+    Gathers [cos, sin] of the phases from a (vocab_size, 2*embed_dim) table of
+    cos | sin and backpropagates to the phase embedding weight, with a dense
+    or, if sparse is set, a row-sparse gradient like that of nn.Embedding.
+    '''
+    @staticmethod
+    def forward(ctx, indices, phase_weight, phase_table, sparse=False):
+        phase_cos, phase_sin = torch.chunk(F.embedding(indices, phase_table), 2, dim=-1)
+        ctx.save_for_backward(indices, phase_cos, phase_sin)
+        ctx.num_embeddings = phase_weight.shape[0]
+        ctx.sparse = sparse
+        return phase_cos, phase_sin
+
+    @staticmethod
+    def backward(ctx, grad_cos, grad_sin):
+        indices, phase_cos, phase_sin = ctx.saved_tensors
+        grad_phase_weight = None
+        if ctx.needs_input_grad[1]:
+            grad_phase = grad_sin * phase_cos - grad_cos * phase_sin
+            embed_dim = grad_phase.shape[-1]
+            if ctx.sparse:
+                grad_phase_weight = torch.sparse_coo_tensor(indices.reshape(1, -1), grad_phase.reshape(-1, embed_dim),
+                                                            (ctx.num_embeddings, embed_dim))
+            else:
+                grad_phase_weight = grad_phase.new_zeros(ctx.num_embeddings, embed_dim).index_add_(
+                        0, indices.reshape(-1), grad_phase.reshape(-1, embed_dim))
+        return None, grad_phase_weight, None, None
+
+class CachedComplexEmbedding(ComplexEmbedding):
+    '''
+    ComplexEmbedding that keeps a vocabulary-level table of cos/sin of the
+    phases and returns the phase as [cos, sin], which ComplexMultiply takes in
+    place of the phase. Lookups are a single gather.
+    After an update of the phase weights only the rows looked up since the
+    last refresh are recomputed. This covers optimizers that leave rows with
+    zero gradient unchanged, such as SGD and RMSprop; call refresh() after
+    updates that touch other rows. In eval mode the table is built once and
+    reused until the weights change. The state_dict is that of ComplexEmbedding.
+    '''
+    def __init__(self, opt, embedding_matrix, freeze=False, sparse=False):
+        super(CachedComplexEmbedding, self).__init__(opt, embedding_matrix, freeze=freeze, sparse=sparse)
+        phase_weight = self.phase_embed.weight.detach()
+        self.register_buffer('phase_table', torch.cat([torch.cos(phase_weight), torch.sin(phase_weight)], dim=-1), persistent=False)
+        self._table_state = self.phase_state()
+        # indices looked up since the last refresh, None when every row may have changed
+        self._touched = []
+
+    def phase_state(self):
+        phase_weight = self.phase_embed.weight
+        return (phase_weight._version, phase_weight.data_ptr())
+
+    def refresh(self, indices=None):
+        phase_weight = self.phase_embed.weight.detach()
+        with torch.no_grad():
+            if indices is None:
+                self.phase_table = torch.cat([torch.cos(phase_weight), torch.sin(phase_weight)], dim=-1)
+            else:
+                rows = torch.unique(indices)
+                self.phase_table[rows] = torch.cat([torch.cos(phase_weight[rows]), torch.sin(phase_weight[rows])], dim=-1)
+        self._table_state = self.phase_state()
+        self._touched = []
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super(CachedComplexEmbedding, self)._load_from_state_dict(*args, **kwargs)
+        self._touched = None
+
+    def forward(self, indices):
+        state = self.phase_state()
+        if state != self._table_state:
+            # a replaced weight tensor (e.g. moved to another device) is rebuilt in full
+            if self._touched is None or len(self._touched) == 0 or state[1] != self._table_state[1]:
+                self.refresh()
+            else:
+                self.refresh(torch.cat(self._touched))
+        if self.training and self.phase_embed.weight.requires_grad and self._touched is not None:
+            self._touched.append(indices.reshape(-1))
+
+        amplitude_embed = self.amplitude_embed(indices)
+        phase_cos, phase_sin = PhaseLookupFunction.apply(indices, self.phase_embed.weight, self.phase_table, self.sparse)
+        return [amplitude_embed, [phase_cos, phase_sin]]
     
+def complex_embedding(opt, embedding_matrix, sparse=False):
+    '''
+    The complex embedding layer selected by opt: CachedComplexEmbedding with
+    cached_phase_table, which keeps vocabulary-level cos/sin tables of the
+    phases, InterleavedComplexEmbedding with interleaved_embedding, one
+    (vocab_size, 2*embed_dim) table gathered once per forward, and
+    ComplexEmbedding otherwise.
+    '''
+    if opt.__dict__.get('cached_phase_table', False):
+        return CachedComplexEmbedding(opt, embedding_matrix, sparse = sparse)
+    if opt.__dict__.get('interleaved_embedding', False):
+        return InterleavedComplexEmbedding(opt, embedding_matrix, sparse = sparse)
+    return ComplexEmbedding(opt, embedding_matrix, sparse = sparse)
 
 def test():
     phase_embed = PhaseEmbedding(5, 10)
@@ -59,6 +214,36 @@ def test():
     else:
         print('Embedding Test Failed.')
 
+    embedding_matrix = torch.randn(10, 5)
+    complex_embed = ComplexEmbedding(None, embedding_matrix)
+    cached_embed = CachedComplexEmbedding(None, embedding_matrix)
+    indices = torch.tensor([[1, 2, 2], [3, 1, 0]])
+    with torch.no_grad():
+        cached_embed.phase_embed.weight[1] += 0.5
+        complex_embed.phase_embed.weight[1] += 0.5
+    cached_embed.refresh()
+    _, phase = complex_embed(indices)
+    _, [phase_cos, phase_sin] = cached_embed(indices)
+    (phase_cos.sum() + 2 * phase_sin.sum()).backward()
+    (torch.cos(phase).sum() + 2 * torch.sin(phase).sum()).backward()
+    if torch.allclose(phase_cos, torch.cos(phase)) and torch.allclose(phase_sin, torch.sin(phase)) \
+        and torch.allclose(cached_embed.phase_embed.weight.grad, complex_embed.phase_embed.weight.grad):
+        print('CachedComplexEmbedding Test Passed.')
+    else:
+        print('CachedComplexEmbedding Test Failed.')
+
+    interleaved_embed = InterleavedComplexEmbedding(None, embedding_matrix)
+    interleaved_embed.load_state_dict(complex_embed.state_dict())
+    amplitude, phase = complex_embed(indices)
+    interleaved_amplitude, interleaved_phase = interleaved_embed(indices)
+    state_dict = interleaved_embed.state_dict()
+    if torch.equal(amplitude, interleaved_amplitude) and torch.equal(phase, interleaved_phase) \
+        and state_dict.keys() == complex_embed.state_dict().keys() \
+        and torch.equal(state_dict['phase_embed.weight'], complex_embed.phase_embed.weight):
+        print('InterleavedComplexEmbedding Test Passed.')
+    else:
+        print('InterleavedComplexEmbedding Test Failed.')
+
 
 if __name__ == '__main__':
     test()
\ No newline at end of file
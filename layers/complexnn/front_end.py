@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import torch
+from layers.complexnn.l2_norm import L2Norm
+from layers.complexnn.l2_normalization import L2Normalization
+from layers.complexnn.multiply import ComplexMultiply
+
+class FrontEndFunction(torch.autograd.Function):
+    '''
+    Fused L2Norm + L2Normalization + Softmax + ComplexMultiply.
+    amplitude, phase: (batch_size, seq_len, embed_dim)
+    mask: optional (batch_size, seq_len) bool tensor, False positions get weight 0
+    Returns the weights (batch_size, seq_len, 1), softmaxed over dim 1 if
+    softmax is set, and the real and imaginary parts of the normalized states.
+    The squared norm is computed once, and backward recomputes the states
+    from amplitude and phase instead of saving the intermediates.
+    '''
+    @staticmethod
+    def forward(ctx, amplitude, phase, mask=None, softmax=True):
+        square_norm = torch.sum(amplitude**2, dim=-1, keepdim=True)
+        weights = torch.sqrt(0.00001 + square_norm)
+        normalized = amplitude / torch.clamp(torch.sqrt(square_norm), min=1e-12)
+        real_part = torch.cos(phase) * normalized
+        imag_part = torch.sin(phase) * normalized
+        if mask is not None:
+            weights = weights.masked_fill(~torch.unsqueeze(mask, dim=-1), float('-inf'))
+        if softmax:
+            weights = torch.softmax(weights, dim=1)
+        ctx.softmax = softmax
+        ctx.mask = mask
+        ctx.save_for_backward(amplitude, phase, weights)
+        return weights, real_part, imag_part
+
+    @staticmethod
+    def backward(ctx, grad_weights, grad_real, grad_imag):
+        amplitude, phase, weights = ctx.saved_tensors
+        grad_amplitude = grad_phase = None
+
+        square_norm = torch.sum(amplitude**2, dim=-1, keepdim=True)
+        norm = torch.sqrt(square_norm)
+        clamped_norm = torch.clamp(norm, min=1e-12)
+        normalized = amplitude / clamped_norm
+        cos = torch.cos(phase)
+        sin = torch.sin(phase)
+
+        if ctx.needs_input_grad[1]:
+            grad_phase = normalized * (grad_imag * cos - grad_real * sin)
+
+        if ctx.needs_input_grad[0]:
+            grad_normalized = grad_real * cos + grad_imag * sin
+            # F.normalize: project out the radial component unless the norm is clamped
+            radial = torch.sum(normalized * grad_normalized, dim=-1, keepdim=True)
+            grad_amplitude = torch.where(norm > 1e-12, grad_normalized - normalized * radial, grad_normalized) / clamped_norm
+            if ctx.softmax:
+                grad_weights = weights * (grad_weights - torch.sum(grad_weights * weights, dim=1, keepdim=True))
+            elif ctx.mask is not None:
+                grad_weights = grad_weights.masked_fill(~torch.unsqueeze(ctx.mask, dim=-1), 0)
+            grad_amplitude = grad_amplitude + grad_weights * amplitude / torch.sqrt(0.00001 + square_norm)
+
+        return grad_amplitude, grad_phase, None, None
+
+class ComplexFrontEnd(torch.nn.Module):
+    '''
+    The L2Norm -> L2Normalization -> Softmax -> ComplexMultiply front end of
+    the models as one module, computed by FrontEndFunction.
+    inputs: [phase, amplitude] as for ComplexMultiply.
+    Returns [weights, [real, imag]], or [weights, state] with a torch.complex64
+    state if use_complex is set. Phases given as [cos, sin] take the unfused path.
+    '''
+    def __init__(self, softmax=True, use_complex=False):
+        super(ComplexFrontEnd, self).__init__()
+        self.softmax = softmax
+        self.use_complex = use_complex
+        self.l2_norm = L2Norm(dim = -1, keep_dims = True)
+        self.l2_normalization = L2Normalization(dim = -1)
+        self.complex_multiply = ComplexMultiply(use_complex = use_complex)
+
+    def forward(self, inputs, mask=None):
+        phase = inputs[0]
+        amplitude = inputs[1]
+
+        if isinstance(phase, list):
+            weights = self.l2_norm(amplitude)
+            amplitude = self.l2_normalization(amplitude)
+            if mask is not None:
+                weights = weights.masked_fill(~torch.unsqueeze(mask, dim=-1), float('-inf'))
+            if self.softmax:
+                weights = torch.softmax(weights, dim=1)
+            return [weights, self.complex_multiply([phase, amplitude])]
+
+        weights, real_part, imag_part = FrontEndFunction.apply(amplitude, phase, mask, self.softmax)
+        if self.use_complex:
+            return [weights, torch.complex(real_part, imag_part)]
+        return [weights, [real_part, imag_part]]
+
+def test():
+    amplitude = torch.randn(3, 5, 4, dtype=torch.double, requires_grad=True)
+    phase = torch.randn(3, 5, 4, dtype=torch.double, requires_grad=True)
+    mask = torch.arange(5).unsqueeze(0) < torch.tensor([[5], [3], [1]])
+    weights, [real_part, imag_part] = ComplexFrontEnd()([phase, amplitude], mask=mask)
+
+    expected_weights = L2Norm(dim=-1)(amplitude).masked_fill(~mask.unsqueeze(-1), float('-inf'))
+    expected_weights = torch.softmax(expected_weights, dim=1)
+    [expected_real, expected_imag] = ComplexMultiply()([phase, L2Normalization(dim=-1)(amplitude)])
+    passed = torch.allclose(weights, expected_weights) and torch.allclose(real_part, expected_real) \
+        and torch.allclose(imag_part, expected_imag)
+    for softmax in [True, False]:
+        passed = passed and torch.autograd.gradcheck(lambda a, p: FrontEndFunction.apply(a, p, mask if softmax else None, softmax),
+                                                       [amplitude, phase])
+    if passed:
+        print('ComplexFrontEnd Test Passed.')
+    else:
+        print('ComplexFrontEnd Test Failed.')
+
+if __name__ == '__main__':
+    test()
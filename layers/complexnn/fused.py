@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+def _amplitudes(input_real, input_imag, real_kernel, imag_kernel):
+    # <m_k|psi_t> as used by ComplexMeasurement, shape (..., units)
+    amplitude_real = torch.matmul(input_real, real_kernel.t()) - torch.matmul(input_imag, imag_kernel.t())
+    amplitude_imag = torch.matmul(input_real, imag_kernel.t()) + torch.matmul(input_imag, real_kernel.t())
+    return amplitude_real, amplitude_imag
+
+class MixtureMeasurementFunction(torch.autograd.Function):
+    '''
+    Fused ComplexMixture + ComplexMeasurement.
+    p_k = sum_t w_t * |<m_k|psi_t>|^2, summed over dim 1 like ComplexMixture.
+    input_real, input_imag: (batch_size, seq_len, ..., embed_dim)
+    weight: (batch_size, seq_len, ..., 1)
+    real_kernel, imag_kernel: (units, embed_dim)
+    Only the inputs are saved for backward, the (..., units) amplitudes are
+    recomputed there instead of keeping D x D mixtures and projectors alive.
+    '''
+    @staticmethod
+    def forward(ctx, input_real, input_imag, weight, real_kernel, imag_kernel):
+        ctx.save_for_backward(input_real, input_imag, weight, real_kernel, imag_kernel)
+        amplitude_real, amplitude_imag = _amplitudes(input_real, input_imag, real_kernel, imag_kernel)
+        return torch.sum((amplitude_real**2 + amplitude_imag**2) * weight, dim=1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        input_real, input_imag, weight, real_kernel, imag_kernel = ctx.saved_tensors
+        grad_input_real = grad_input_imag = grad_weight = grad_real_kernel = grad_imag_kernel = None
+
+        amplitude_real, amplitude_imag = _amplitudes(input_real, input_imag, real_kernel, imag_kernel)
+        # restore the summed dimension
+        grad_output = grad_output.unsqueeze(1)
+
+        if ctx.needs_input_grad[2]:
+            grad_weight = torch.sum((amplitude_real**2 + amplitude_imag**2) * grad_output, dim=-1, keepdim=True)
+
+        grad_amplitude_real = 2 * grad_output * weight * amplitude_real
+        grad_amplitude_imag = 2 * grad_output * weight * amplitude_imag
+
+        if ctx.needs_input_grad[0]:
+            grad_input_real = torch.matmul(grad_amplitude_real, real_kernel) + torch.matmul(grad_amplitude_imag, imag_kernel)
+        if ctx.needs_input_grad[1]:
+            grad_input_imag = torch.matmul(grad_amplitude_imag, real_kernel) - torch.matmul(grad_amplitude_real, imag_kernel)
+
+        if ctx.needs_input_grad[3] or ctx.needs_input_grad[4]:
+            units, embed_dim = real_kernel.shape
+            grad_amplitude_real = grad_amplitude_real.reshape(-1, units).t()
+            grad_amplitude_imag = grad_amplitude_imag.reshape(-1, units).t()
+            input_real = input_real.reshape(-1, embed_dim)
+            input_imag = input_imag.reshape(-1, embed_dim)
+            if ctx.needs_input_grad[3]:
+                grad_real_kernel = torch.matmul(grad_amplitude_real, input_real) + torch.matmul(grad_amplitude_imag, input_imag)
+            if ctx.needs_input_grad[4]:
+                grad_imag_kernel = torch.matmul(grad_amplitude_imag, input_real) - torch.matmul(grad_amplitude_real, input_imag)
+
+        return grad_input_real, grad_input_imag, grad_weight, grad_real_kernel, grad_imag_kernel
+
+def mixture_measurement(input_real, input_imag, weight, real_kernel, imag_kernel):
+    return MixtureMeasurementFunction.apply(input_real, input_imag, weight, real_kernel, imag_kernel)
+
+def test():
+    from layers.complexnn.mixture import ComplexMixture
+    from layers.complexnn.measurement import ComplexMeasurement
+    measurement = ComplexMeasurement(6, units=3, device=torch.device('cpu'))
+    measurement.kernel.data = measurement.kernel.data.cpu()
+    a = torch.randn(5, 4, 6)
+    b = torch.randn(5, 4, 6)
+    c = torch.softmax(torch.randn(5, 4, 1), dim=1)
+    dense = measurement(ComplexMixture()([a, b, c]))
+    fused = mixture_measurement(a, b, c, measurement.kernel[:,:,0], measurement.kernel[:,:,1])
+
+    inputs = [torch.randn(2, 3, 4, 5, dtype=torch.double, requires_grad=True),
+              torch.randn(2, 3, 4, 5, dtype=torch.double, requires_grad=True),
+              torch.rand(2, 3, 4, 1, dtype=torch.double, requires_grad=True),
+              torch.randn(6, 5, dtype=torch.double, requires_grad=True),
+              torch.randn(6, 5, dtype=torch.double, requires_grad=True)]
+    if torch.allclose(dense, fused, atol=1e-5) and torch.autograd.gradcheck(MixtureMeasurementFunction.apply, inputs):
+        print('MixtureMeasurementFunction Test Passed.')
+    else:
+        print('MixtureMeasurementFunction Test Failed.')
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import torch
+import torch.nn.functional as F
+
+class LocalMixture(torch.nn.Module):
+    '''
+    Measurement probabilities of the n-gram local mixtures, for all n at once.
+    Measurement is linear in the density matrix, so measuring the mixture of
+    an n-gram window equals the softmax-weighted window sum of the per-token
+    probabilities. Window sums are taken with one avg_pool1d per n, rather
+    than as differences of prefix sums, which lose float32 precision to
+    cancellation on long sequences; no density matrix is formed.
+    Windows follow NGram: n-1 padded positions split left/right, each with
+    weight 0 before the softmax and a zero state.
+    inputs: [probs, weights], probs (batch_size, seq_len, units) from
+    ComplexMeasurement.measure_pure_states, weights (batch_size, seq_len, 1)
+    the mixture weights before the softmax.
+    Returns a list with one (batch_size, seq_len, units) tensor per gram_n.
+    '''
+    def __init__(self, gram_n_list=[3]):
+        super(LocalMixture, self).__init__()
+        self.gram_n_list = [int(gram_n) for gram_n in gram_n_list]
+
+    def forward(self, inputs):
+
+        if not isinstance(inputs, list):
+            raise ValueError('This layer should be called '
+                             'on a list of 2 inputs.')
+
+        if len(inputs) != 2:
+            raise ValueError('This layer should be called '
+                            'on a list of 2 inputs.'
+                            'Got ' + str(len(inputs)) + ' inputs.')
+
+        probs = inputs[0]
+        weights = inputs[1]
+        if weights.dim() == probs.dim()-1:
+            weights = torch.unsqueeze(weights, dim=-1)
+
+        seq_len = probs.shape[1]
+        left_padded_lens = [int((gram_n-1)/2) for gram_n in self.gram_n_list]
+        right_padded_lens = [gram_n-1-left for gram_n, left in zip(self.gram_n_list, left_padded_lens)]
+        max_left = max(left_padded_lens)
+        max_right = max(right_padded_lens)
+
+        # shift for a stable softmax, padded positions have weight 0
+        shift = torch.clamp(torch.max(weights, dim=1, keepdim=True)[0], min=0)
+        exp_weights = torch.exp(weights - shift)
+        padded_exp_weight = torch.exp(-shift)
+
+        # numerator and denominator as channels of one (batch_size, units+1, length)
+        # sequence, padded for the widest window
+        terms = torch.cat([exp_weights * probs, exp_weights.expand(probs.shape[:-1] + (1,))], dim=-1)
+        terms = F.pad(terms, (0, 0, max_left, max_right)).transpose(1, 2)
+
+        positions = torch.arange(seq_len, device=probs.device)
+        outputs = []
+        for gram_n, left, right in zip(self.gram_n_list, left_padded_lens, right_padded_lens):
+            begin = max_left - left
+            window_sums = F.avg_pool1d(terms[:, :, begin:begin+seq_len+gram_n-1], gram_n, stride=1) * gram_n
+            window_sums = window_sums.transpose(1, 2)
+            window_numerator = window_sums[..., :-1]
+            window_denominator = window_sums[..., -1:]
+            # padded positions inside each window contribute exp(0 - shift) to the softmax
+            num_valid = torch.clamp(positions + right, max=seq_len-1) - torch.clamp(positions - left, min=0) + 1
+            num_padded = (gram_n - num_valid).to(probs.dtype).view(1, -1, 1)
+            window_denominator = window_denominator + num_padded * padded_exp_weight
+            outputs.append(window_numerator / window_denominator)
+
+        return outputs
+
+def test():
+    from layers.complexnn.ngram import NGram
+    from layers.complexnn.mixture import ComplexMixture
+    from layers.complexnn.measurement import ComplexMeasurement
+    measurement = ComplexMeasurement(6, units=3, device=torch.device('cpu'))
+    measurement.kernel.data = measurement.kernel.data.cpu()
+    a = torch.randn(2, 7, 6)
+    b = torch.randn(2, 7, 6)
+    c = torch.randn(2, 7, 1)
+    local_mixture = LocalMixture([1, 2, 3, 4])
+    outputs = local_mixture([measurement.measure_pure_states([a, b]), c])
+    passed = True
+    for gram_n, output in zip(local_mixture.gram_n_list, outputs):
+        n_gram = NGram(gram_n=gram_n)
+        weights = torch.softmax(n_gram(c), dim=1)
+        expected = measurement(ComplexMixture()([n_gram(a), n_gram(b), weights]))
+        passed = passed and torch.allclose(output, expected, atol=1e-5)
+
+    # long sequences: small windows far from the start keep their precision
+    probs = torch.rand(1, 20000, 3)
+    weights = torch.randn(1, 20000, 1)
+    outputs = local_mixture([probs, weights])
+    for gram_n, output in zip(local_mixture.gram_n_list, outputs):
+        # softmax over each window in float64, padded positions with weight 0 and a zero state
+        left = int((gram_n-1)/2)
+        padded_probs = F.pad(probs.double(), (0, 0, left, gram_n-1-left)).unfold(1, gram_n, 1)
+        padded_weights = F.pad(weights.double(), (0, 0, left, gram_n-1-left)).unfold(1, gram_n, 1)
+        expected = torch.sum(torch.softmax(padded_weights, dim=-1) * padded_probs, dim=-1)
+        passed = passed and torch.allclose(output.double(), expected, atol=1e-5)
+    if passed:
+        print('LocalMixture Test Passed.')
+    else:
+        print('LocalMixture Test Failed.')
+
+if __name__ == '__main__':
+    test()
@@ -3,12 +3,18 @@
 import torch
 import torch.nn.functional as F
 import torch.nn
+from layers.complexnn.fused import mixture_measurement
+from layers.complexnn.utils import parameter_state, hermitian_indices
 
 class ComplexMeasurement(torch.nn.Module):
-    def __init__(self, embed_dim, units=5, ortho_init=False, device = torch.device('cpu')):
+    def __init__(self, embed_dim, units=5, ortho_init=False, device = torch.device('cpu'), fused=False):
         super(ComplexMeasurement, self).__init__()
         self.units = units
         self.embed_dim = embed_dim
+        # measure factored mixtures with the hand-written backward of layers.complexnn.fused
+        self.fused = fused
+        # flattened projectors, rebuilt only when the kernel or the mode changes
+        self._projector_cache = {}
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         if ortho_init:
             self.kernel = torch.nn.Parameter(torch.stack([torch.eye(embed_dim).to(device),torch.zeros(embed_dim, embed_dim).to(device)],dim = -1))
@@ -24,56 +30,193 @@ class ComplexMeasurement(torch.nn.Module):
 
 #            self.real_kernel = torch.nn.Parameter(torch.Tensor(self.units, embed_dim))
 #            self.imag_kernel = torch.nn.Parameter(torch.Tensor(self.units, embed_dim))
+        # stepped on the unitary manifold by the optimizer.*_Unitary optimizers
+        self.kernel.unitary = True
 
     def forward(self, inputs, measure_operator=None):
+
+        if torch.is_tensor(inputs) or inputs[0].is_complex():
+            return self.complex_forward(inputs, measure_operator=measure_operator)
         
         input_real = inputs[0]
         input_imag = inputs[1]
+
+        if len(inputs) == 3:
+            # factored mixture [real, imag, weight] from ComplexMixture(factored=True):
+            # p_k = sum_t w_t * |<m_k|psi_t>|^2, the density matrix is never formed
+            if self.fused:
+                if measure_operator is None:
+                    measure_operator = [self.kernel[:,:,0], self.kernel[:,:,1]]
+                return mixture_measurement(input_real, input_imag, inputs[2], measure_operator[0], measure_operator[1])
+            probs = self.measure_pure_states([input_real, input_imag], measure_operator=measure_operator)
+            return torch.sum(probs * inputs[2], dim=1)
         
-        real_kernel = self.kernel[:,:,0]
-        imag_kernel = self.kernel[:,:,1]
+        if input_real.shape[-1] != input_imag.shape[-1]:
+            # packed Hermitian [(..., D(D+1)/2), (..., D(D-1)/2)] from ComplexMixture(packed=True)
+            if measure_operator is None:
+                projector_real, projector_imag = self.get_projectors(layout='packed')
+            else:
+                projector_real, projector_imag = self.build_packed_projectors(measure_operator[0], measure_operator[1])
+            return torch.matmul(input_real, projector_real) - torch.matmul(input_imag, projector_imag)
+
         if measure_operator is None:
-            real_kernel = real_kernel.unsqueeze(-1)
-            imag_kernel = imag_kernel.unsqueeze(-1)
+            projector_real, projector_imag = self.get_projectors()
         else:
-            real_kernel = measure_operator[0].unsqueeze(-1)
-            imag_kernel = measure_operator[1].unsqueeze(-1)
+            projector_real, projector_imag = self.build_projectors(measure_operator[0], measure_operator[1])
 
-        projector_real = torch.matmul(real_kernel, real_kernel.transpose(1, 2)) \
-            + torch.matmul(imag_kernel, imag_kernel.transpose(1, 2))  
-        projector_imag = torch.matmul(imag_kernel, real_kernel.transpose(1, 2)) \
-            - torch.matmul(real_kernel, imag_kernel.transpose(1, 2))
         # only real part is non-zero
         # input_real.shape = [batch_size, seq_len, embed_dim, embed_dim] or [batch_size, embed_dim, embed_dim]
-        # projector_real.shape = [num_measurements, embed_dim, embed_dim]
-        output_real = torch.matmul(torch.flatten(input_real, start_dim = -2, end_dim = -1), torch.flatten(projector_real, start_dim = -2, end_dim = -1).t())\
-            - torch.matmul(torch.flatten(input_imag, start_dim = -2, end_dim = -1), torch.flatten(projector_imag, start_dim = -2, end_dim = -1).t())
+        # projector_real.shape = [embed_dim*embed_dim, num_measurements]
+        output_real = torch.matmul(torch.flatten(input_real, start_dim = -2, end_dim = -1), projector_real)\
+            - torch.matmul(torch.flatten(input_imag, start_dim = -2, end_dim = -1), projector_imag)
     
         return output_real
+
+    def build_projectors(self, real_kernel, imag_kernel):
+        """
+        Projectors |m_k><m_k| of the (units, embed_dim) kernel, flattened to
+        (embed_dim*embed_dim, units) for the measurement matmul.
+        """
+        real_kernel = real_kernel.unsqueeze(-1)
+        imag_kernel = imag_kernel.unsqueeze(-1)
+
+        projector_real = torch.matmul(real_kernel, real_kernel.transpose(1, 2)) \
+            + torch.matmul(imag_kernel, imag_kernel.transpose(1, 2))  
+        projector_imag = torch.matmul(imag_kernel, real_kernel.transpose(1, 2)) \
+            - torch.matmul(real_kernel, imag_kernel.transpose(1, 2))
+
+        return [torch.flatten(projector_real, start_dim = -2, end_dim = -1).t(),
+                torch.flatten(projector_imag, start_dim = -2, end_dim = -1).t()]
+
+    def build_packed_projectors(self, real_kernel, imag_kernel):
+        """
+        Projectors in the packed Hermitian layout, shaped (D(D+1)/2, units) and
+        (D(D-1)/2, units). Off-diagonal entries are doubled so that the packed
+        matmul sums over both triangles of the symmetric real and the
+        antisymmetric imaginary parts.
+        """
+        embed_dim = real_kernel.shape[-1]
+        rows, cols = hermitian_indices(embed_dim, real_kernel.device)
+        num_strict = embed_dim * (embed_dim - 1) // 2
+        real_rows, real_cols = real_kernel[:, rows], real_kernel[:, cols]
+        imag_rows, imag_cols = imag_kernel[:, rows], imag_kernel[:, cols]
+
+        projector_real = real_rows * real_cols + imag_rows * imag_cols
+        projector_real = torch.cat([2 * projector_real[:, :num_strict], projector_real[:, num_strict:]], dim=-1)
+        projector_imag = 2 * (imag_rows[:, :num_strict] * real_cols[:, :num_strict]
+                              - real_rows[:, :num_strict] * imag_cols[:, :num_strict])
+        return [projector_real.t(), projector_imag.t()]
+
+    def build_complex_projectors(self, kernel):
+        """
+        Projectors m_i * conj(m_j) of the (units, embed_dim) complex kernel,
+        flattened to (embed_dim*embed_dim, units).
+        """
+        projector = torch.unsqueeze(kernel, dim=-1) * torch.unsqueeze(kernel.conj(), dim=-2)
+        return torch.flatten(projector, start_dim = -2, end_dim = -1).t()
+
+    def get_projectors(self, layout='dense'):
+        """
+        Cached build_projectors of self.kernel. Repeated calls within one
+        forward share the projectors, and in eval mode they are kept until
+        the kernel changes.
+        layout 'complex' returns the complex64 projectors of the complex backend,
+        layout 'packed' those of build_packed_projectors.
+        """
+        state = parameter_state(self, self.kernel)
+        cached = self._projector_cache.get(layout)
+        if cached is None or cached[0] != state:
+            if layout == 'complex':
+                projectors = self.build_complex_projectors(torch.view_as_complex(self.kernel))
+            elif layout == 'packed':
+                projectors = self.build_packed_projectors(self.kernel[:,:,0], self.kernel[:,:,1])
+            else:
+                projectors = self.build_projectors(self.kernel[:,:,0], self.kernel[:,:,1])
+            cached = (state, projectors)
+            self._projector_cache[layout] = cached
+        return cached[1]
+
+    def complex_forward(self, inputs, measure_operator=None):
+        # complex64 backend: inputs is a density matrix (..., embed_dim, embed_dim)
+        # or a factored mixture [state, weight] from ComplexMixture
+        if isinstance(inputs, list):
+            probs = self.measure_pure_states(inputs[0], measure_operator=measure_operator)
+            return torch.sum(probs * inputs[1], dim=1)
+
+        if measure_operator is None:
+            projector = self.get_projectors(layout='complex')
+        else:
+            projector = self.build_complex_projectors(self.complex_kernel(measure_operator))
+
+        # Re sum_ij rho_ij m_i conj(m_j), the same quantity as the [real, imag] path
+        return torch.matmul(torch.flatten(inputs, start_dim = -2, end_dim = -1), projector).real
+
+    def complex_kernel(self, measure_operator=None):
+        if measure_operator is None:
+            return torch.view_as_complex(self.kernel)
+        if torch.is_tensor(measure_operator):
+            return measure_operator
+        return torch.complex(measure_operator[0], measure_operator[1])
+
+    def __getstate__(self):
+        # the cached projectors may hold an autograd graph, which cannot be copied
+        state = self.__dict__.copy()
+        state['_projector_cache'] = {}
+        return state
+
+    def measure_pure_states(self, inputs, measure_operator=None):
+        """
+        Measurement probabilities of every pure state in inputs = [real, imag],
+        each of shape (..., embed_dim). Returns a tensor of shape (..., units).
+        Equals measuring the rank-one density matrix psi*psi^H in forward.
+        A torch.complex64 tensor is accepted in place of [real, imag].
+        """
+        if torch.is_tensor(inputs):
+            amplitude = torch.matmul(inputs, self.complex_kernel(measure_operator).t())
+            return amplitude.real**2 + amplitude.imag**2
+
+        input_real = inputs[0]
+        input_imag = inputs[1]
+
+        if measure_operator is None:
+            real_kernel = self.kernel[:,:,0]
+            imag_kernel = self.kernel[:,:,1]
+        else:
+            real_kernel = measure_operator[0]
+            imag_kernel = measure_operator[1]
+
+        amplitude_real = torch.matmul(input_real, real_kernel.t()) - torch.matmul(input_imag, imag_kernel.t())
+        amplitude_imag = torch.matmul(input_real, imag_kernel.t()) + torch.matmul(input_imag, real_kernel.t())
+
+        return amplitude_real**2 + amplitude_imag**2
+
+def test():
+    from layers.complexnn.mixture import ComplexMixture
+    measurement = ComplexMeasurement(6, units=3, device=torch.device('cpu'))
+    measurement.kernel.data = measurement.kernel.data.cpu()
+    a = torch.randn(5, 4, 6)
+    b = torch.randn(5, 4, 6)
+    c = torch.softmax(torch.randn(5, 4, 1), dim=1)
+    dense = measurement(ComplexMixture()([a, b, c]))
+    factored = measurement(ComplexMixture(factored=True)([a, b, c]))
+    if dense.shape == (5, 3) and torch.allclose(dense, factored, atol=1e-5):
+        print('ComplexMeasurement Test Passed.')
+    else:
+        print('ComplexMeasurement Test Failed.')
+
+    z = torch.complex(a, b)
+    complex_dense = measurement(ComplexMixture()([z, c]))
+    complex_factored = measurement(ComplexMixture(factored=True)([z, c]))
+    if torch.allclose(dense, complex_dense, atol=1e-5) and torch.allclose(dense, complex_factored, atol=1e-5):
+        print('Complex ComplexMeasurement Test Passed.')
+    else:
+        print('Complex ComplexMeasurement Test Failed.')
+
+    packed = measurement(ComplexMixture(packed=True)([a, b, c]))
+    if torch.allclose(dense, packed, atol=1e-5):
+        print('Packed ComplexMeasurement Test Passed.')
+    else:
+        print('Packed ComplexMeasurement Test Failed.')
     
 if __name__ == '__main__':
-    model = ComplexMeasurement(6, units=3)
-    a = torch.randn(5,6,6)
-    b = torch.randn(5,6,6)
-#
-    y_pred = model([a,b])
-    print(y_pred.shape)
-#    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
+    test()
@@ -2,12 +2,31 @@
 
 import torch
 import torch.nn.functional as F
+from layers.complexnn.utils import packed_outer_products, pack_hermitian
 
 class ComplexMixture(torch.nn.Module):
 
-    def __init__(self, use_weights=True):
+    '''
+    Mixes the pure states of a sequence into a density matrix.
+    factored=True skips the D x D outer products and returns the weighted pure
+    states [real, imag, weight] instead, with weight shaped (..., 1) so that it
+    broadcasts over the embedding dimension. ComplexMeasurement accepts this
+    representation and measures it in O(L*D*K).
+    Given a torch.complex64 state, inputs are [state] or [state, weight] and the
+    output is a complex64 density matrix, or [state, weight] when factored;
+    [state, weight, mask] mixes the valid positions only.
+    packed=True computes only the upper triangles and returns the Hermitian
+    density matrix packed as [(..., D(D+1)/2), (..., D(D-1)/2)] in the order of
+    utils.hermitian_indices, which ComplexMeasurement consumes directly.
+    A fourth input, a (batch_size, seq_len) boolean mask, restricts the mixture
+    to the valid positions: the outer products of padded positions are never
+    computed and factored mixtures get zero weight there.
+    '''
+    def __init__(self, use_weights=True, factored=False, packed=False):
         super(ComplexMixture, self).__init__()
         self.use_weights = use_weights
+        self.factored = factored
+        self.packed = packed
 
     def forward(self, inputs):
 
@@ -15,11 +34,25 @@ class ComplexMixture(torch.nn.Module):
             raise ValueError('This layer should be called '
                              'on a list of 2/3 inputs.')
 
-        if len(inputs) != 3 and len(inputs) != 2:
+        if inputs[0].is_complex():
+            return self.complex_forward(inputs)
+
+        if len(inputs) not in [2, 3, 4]:
             raise ValueError('This layer should be called '
-                            'on a list of 2/3 inputs.'
+                            'on a list of 2/3/4 inputs.'
                             'Got ' + str(len(inputs)) + ' inputs.')
 
+        if len(inputs) == 4:
+            return self.masked_forward(inputs)
+
+        if self.factored:
+            return self.factorize(inputs)
+
+        if self.packed:
+            weight = self.factorize(inputs)[2]
+            packed_real, packed_imag = packed_outer_products(inputs[0], inputs[1])
+            return [torch.sum(packed_real * weight, dim=1), torch.sum(packed_imag * weight, dim=1)]
+
         input_real = torch.unsqueeze(inputs[0], dim=-1) 
         input_imag = torch.unsqueeze(inputs[1], dim=-1) 
         
@@ -50,6 +83,80 @@ class ComplexMixture(torch.nn.Module):
 
         return [output_r, output_i]
 
+    def factorize(self, inputs):
+        if not self.use_weights:
+            # uniform weights reproduce the mean over dim 1
+            weight = torch.ones_like(inputs[0][..., :1]) / inputs[0].shape[1]
+        elif inputs[2].dim() == inputs[1].dim()-1:
+            weight = torch.unsqueeze(inputs[2], dim=-1)
+        else:
+            weight = inputs[2]
+
+        return [inputs[0], inputs[1], weight.float()]
+
+    def masked_forward(self, inputs):
+        input_real, input_imag, weight, mask = inputs
+        mask = mask.bool()
+        if not self.use_weights:
+            weight = mask.float() / mask.sum(dim=1, keepdim=True).float()
+        weight = weight.reshape(mask.shape).float() * mask.float()
+
+        if self.factored:
+            return [input_real, input_imag, torch.unsqueeze(weight, dim=-1)]
+
+        # mix the valid tokens only and scatter them back to their sentences
+        batch_index = torch.nonzero(mask, as_tuple=True)[0]
+        input_real = input_real[mask]
+        input_imag = input_imag[mask]
+        weight = torch.unsqueeze(weight[mask], dim=-1)
+        if self.packed:
+            outputs = packed_outer_products(input_real, input_imag)
+        else:
+            weight = torch.unsqueeze(weight, dim=-1)
+            input_real_transpose = torch.unsqueeze(input_real, dim=-2)
+            input_imag_transpose = torch.unsqueeze(input_imag, dim=-2)
+            input_real = torch.unsqueeze(input_real, dim=-1)
+            input_imag = torch.unsqueeze(input_imag, dim=-1)
+            outputs = [torch.matmul(input_real, input_real_transpose) + torch.matmul(input_imag, input_imag_transpose),
+                       torch.matmul(input_imag, input_real_transpose) - torch.matmul(input_real, input_imag_transpose)]
+
+        batch_size = mask.shape[0]
+        return [output.new_zeros((batch_size,) + output.shape[1:]).index_add(0, batch_index, output * weight)
+                for output in outputs]
+
+    def complex_forward(self, inputs):
+        state = inputs[0]
+        if not self.use_weights:
+            weight = torch.ones_like(state.real[..., :1]) / state.shape[1]
+        elif inputs[1].dim() == state.dim()-1:
+            weight = torch.unsqueeze(inputs[1], dim=-1)
+        else:
+            weight = inputs[1]
+
+        if len(inputs) == 3:
+            return self.masked_complex_forward(state, weight, inputs[2])
+
+        if self.factored:
+            return [state, weight.float()]
+
+        # rho = sum_t w_t * psi_t psi_t^H, contracted over dim 1 without per-token outer products
+        return torch.einsum('bt...i,bt...j->b...ij', state * weight, state.conj())
+
+    def masked_complex_forward(self, state, weight, mask):
+        mask = mask.bool()
+        if not self.use_weights:
+            weight = (mask.float() / mask.sum(dim=1, keepdim=True).float()).unsqueeze(-1)
+        weight = weight.float() * torch.unsqueeze(mask, dim=-1).float()
+
+        if self.factored:
+            return [state, weight]
+
+        # as masked_forward, the outer products of the valid tokens only, scattered back to their sentences
+        batch_index = torch.nonzero(mask, as_tuple=True)[0]
+        state = state[mask]
+        outputs = torch.einsum('ni,nj->nij', state * weight[mask], state.conj())
+        return outputs.new_zeros((mask.shape[0],) + outputs.shape[1:]).index_add(0, batch_index, outputs)
+
 def test():
     mixture = ComplexMixture()
     a = torch.randn(3, 4, 10)
@@ -62,5 +169,42 @@ def test():
     else:
         print('ComplexMixture Test Failed.')
 
+    factored_mix = ComplexMixture(factored=True)([a, b, c])
+    if len(factored_mix) == 3 and factored_mix[2].shape == (3, 4, 1):
+        print('Factored ComplexMixture Test Passed.')
+    else:
+        print('Factored ComplexMixture Test Failed.')
+
+    complex_mix = mixture([torch.complex(a, b), c])
+    if torch.allclose(complex_mix.real, mix[0], atol=1e-5) and torch.allclose(complex_mix.imag, mix[1], atol=1e-5):
+        print('Complex ComplexMixture Test Passed.')
+    else:
+        print('Complex ComplexMixture Test Failed.')
+
+    packed_mix = ComplexMixture(packed=True)([a, b, c])
+    expected = pack_hermitian(mix)
+    if torch.allclose(packed_mix[0], expected[0], atol=1e-5) and torch.allclose(packed_mix[1], expected[1], atol=1e-5):
+        print('Packed ComplexMixture Test Passed.')
+    else:
+        print('Packed ComplexMixture Test Failed.')
+
+    mask = torch.arange(4).unsqueeze(0) < torch.tensor([[4], [2], [1]])
+    masked_mix = mixture([a, b, c, mask])
+    passed = True
+    for i, length in enumerate([4, 2, 1]):
+        expected = mixture([a[i:i+1, :length], b[i:i+1, :length], c[i:i+1, :length]])
+        passed = passed and torch.allclose(masked_mix[0][i], expected[0][0], atol=1e-5) \
+            and torch.allclose(masked_mix[1][i], expected[1][0], atol=1e-5)
+    if passed:
+        print('Masked ComplexMixture Test Passed.')
+    else:
+        print('Masked ComplexMixture Test Failed.')
+
+    masked_complex_mix = mixture([torch.complex(a, b), c, mask])
+    if torch.allclose(masked_complex_mix.real, masked_mix[0], atol=1e-5) and torch.allclose(masked_complex_mix.imag, masked_mix[1], atol=1e-5):
+        print('Masked Complex ComplexMixture Test Passed.')
+    else:
+        print('Masked Complex ComplexMixture Test Failed.')
+
 if __name__ == '__main__':
     test()
\ No newline at end of file
@@ -4,8 +4,13 @@ import torch
 import torch.nn.functional as F
 
 class ComplexMultiply(torch.nn.Module):
-    def __init__(self):
+    '''
+    use_complex=True returns a single torch.complex64 tensor instead of [real, imag].
+    The phase may also be given as [cos, sin], as CachedComplexEmbedding returns it.
+    '''
+    def __init__(self, use_complex=False):
         super(ComplexMultiply, self).__init__()
+        self.use_complex = use_complex
 
     def forward(self, inputs):
 
@@ -20,6 +25,25 @@ class ComplexMultiply(torch.nn.Module):
 
         phase = inputs[0]
         amplitude = inputs[1]
+
+        if isinstance(phase, list):
+            cos, sin = phase
+            if amplitude.dim() == cos.dim()+1:
+                cos = torch.unsqueeze(cos, dim=-1)
+                sin = torch.unsqueeze(sin, dim=-1)
+            elif amplitude.dim() != cos.dim():
+                raise ValueError('input dimensions of phase and amplitude do not agree to each other.')
+            if self.use_complex:
+                return torch.complex(cos*amplitude, sin*amplitude)
+            return [cos*amplitude, sin*amplitude]
+
+        if self.use_complex:
+            if amplitude.dim() == phase.dim()+1:
+                phase = torch.unsqueeze(phase, dim=-1).expand_as(amplitude)
+            elif amplitude.dim() != phase.dim():
+                raise ValueError('input dimensions of phase and amplitude do not agree to each other.')
+            # not torch.polar, which is undefined for the negative amplitudes trained embeddings reach
+            return torch.complex(torch.cos(phase)*amplitude, torch.sin(phase)*amplitude)
         
         if amplitude.dim() == phase.dim()+1: # Assigning each dimension with same phase
             cos = torch.unsqueeze(torch.cos(phase), dim=-1)
@@ -49,5 +73,15 @@ def test():
     else:
         print('ComplexMultiply Test Failed.')
 
+    # negative amplitudes give the same state on both backends
+    phase = torch.randn(3, 4, 10)
+    amplitude = torch.randn(3, 4, 10)
+    real_part, imag_part = multiply([phase, amplitude])
+    state = ComplexMultiply(use_complex=True)([phase, amplitude])
+    if torch.equal(state.real, real_part) and torch.equal(state.imag, imag_part):
+        print('Complex ComplexMultiply Test Passed.')
+    else:
+        print('Complex ComplexMultiply Test Failed.')
+
 if __name__ == '__main__':
     test()
\ No newline at end of file
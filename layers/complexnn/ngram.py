@@ -2,7 +2,6 @@
 
 import torch
 import torch.nn.functional as F
-import numpy as np
 
 class NGram(torch.nn.Module):
     '''
@@ -10,8 +9,9 @@ class NGram(torch.nn.Module):
     gram_n is the value of n
     dim is the dimension to which n-gram is applied
     out_n = seq_len+(n_gram-1)*2-n_gram +1 = 
-    e.g. input_shape = (None,10) gram_n = 5 ==> output_shape = (None,10,5)
-    e.g. input_shape = (None,10,3) gram_n = 5, axis = 1 ==> output_shape = (None,10,5,3)
+    e.g. input_shape = (None,10) gram_n = 5 ==> output_shape = (None,5,10)
+    e.g. input_shape = (None,10,3) gram_n = 5, axis = 1 ==> output_shape = (None,5,10,3)
+    The output is a strided view of the zero-padded input.
     
     '''
     def __init__(self, gram_n=3, dim=1, device = torch.device('cpu')):
@@ -22,29 +22,22 @@ class NGram(torch.nn.Module):
         
     def forward(self, inputs):
         
-        slice_begin_index = 0
-        slice_end_index = -1
-
-        batch_size, seq_len, embed_dim = inputs.shape
+        seq_len = inputs.shape[self.dim]
         total_padded_len = self.gram_n - 1
         left_padded_len = int(total_padded_len/2)
-        right_padded_len = total_padded_len - left_padded_len
-        left_padded_zeros = torch.zeros(batch_size, left_padded_len, embed_dim).to(self.device)
-        right_padded_zeros = torch.zeros(batch_size, right_padded_len, embed_dim).to(self.device)
-        
-        inputs = torch.cat([left_padded_zeros, inputs, right_padded_zeros], dim=self.dim)
 
-        out_n = seq_len 
-        list_of_ngrams = []
-        
-        for i in range(out_n):
-            slice_begin_index = i
-            slice_end_index = i + self.gram_n
-            slice_index = torch.tensor(np.arange(slice_begin_index, slice_end_index), dtype=torch.long).to(self.device)
-            l = torch.index_select(inputs, self.dim, index=slice_index)
-            list_of_ngrams.append(torch.unsqueeze(l, dim=self.dim+1))
-                
-        ngram_mat = torch.cat(list_of_ngrams, dim=self.dim+1)
+        # zero padding on both sides, allocated once
+        padded_shape = list(inputs.shape)
+        padded_shape[self.dim] = seq_len + total_padded_len
+        padded_inputs = inputs.new_zeros(padded_shape)
+        padded_inputs.narrow(self.dim, left_padded_len, seq_len).copy_(inputs)
+
+        # sliding windows as a strided view of the padded tensor: the window
+        # axis is appended by unfold and moved in front of the sequence axis
+        ngram_mat = padded_inputs.unfold(self.dim, self.gram_n, 1)
+        dims = list(range(ngram_mat.dim()))
+        dims.insert(self.dim, dims.pop())
+        ngram_mat = ngram_mat.permute(dims)
         
         return ngram_mat
 
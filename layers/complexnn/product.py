@@ -20,6 +20,9 @@ class ComplexProduct(torch.nn.Module):
         
         left = inputs[0]
         right = inputs[1]
+
+        if torch.is_tensor(left) and left.is_complex():
+            return left * right
         
         left_real = left[0]
         left_imag = left[1]
@@ -5,50 +5,78 @@ import torch.nn
 from .measurement import ComplexMeasurement
 
 class ComplexProjMeasurement(torch.nn.Module):
-    def __init__(self, opt, embed_dim, method='sample', device = torch.device('cpu')):
+    def __init__(self, opt, embed_dim, method='sample', device = torch.device('cpu'), fused=False):
         super(ComplexProjMeasurement, self).__init__()
         self.opt = opt
         self.embed_dim = embed_dim
         self.method = method
-        self.measurement = ComplexMeasurement(embed_dim, units=embed_dim, ortho_init=True, device = device)
+        self.measurement = ComplexMeasurement(embed_dim, units=embed_dim, ortho_init=True, device = device, fused = fused)
 
     def forward(self, inputs):
 
         if not isinstance(inputs, list):
             raise ValueError('This layer should be called '
-                             'on a list of 2 inputs.')
+                             'on a list of 2/3 inputs.')
 
-        if len(inputs) != 2:
+        if len(inputs) != 2 and len(inputs) != 3:
             raise ValueError('This layer should be called '
-                            'on a list of 2 inputs.'
+                            'on a list of 2/3 inputs.'
                             'Got ' + str(len(inputs)) + ' inputs.')
     
-        input_real = inputs[0] 
-        input_imag = inputs[1]
-
-        seq_len = input_real.shape[1]
-        chunks_real = torch.chunk(input_real, seq_len, dim=1)
-        chunks_imag = torch.chunk(input_imag, seq_len, dim=1)
-        real_samples = []
-        imag_samples = []
-        for i in range(seq_len):
-            output = self.measurement([chunks_real[i].squeeze(1), chunks_imag[i].squeeze(1)]).clamp(min=1e-5)
-            if self.method == 'sample':
-                sampled_indice = output.multinomial(1).squeeze(1)
-                real_sample = torch.index_select(self.measurement.kernel[:,:,0], 0, sampled_indice).unsqueeze(1)
-                imag_sample = torch.index_select(self.measurement.kernel[:,:,1], 0, sampled_indice).unsqueeze(1)
-
-            elif self.method == 'ensemble':
-                real_sample = torch.mm(output, self.measurement.kernel[:,:,0]).unsqueeze(1)
-                imag_sample = torch.mm(output, self.measurement.kernel[:,:,1]).unsqueeze(1)
-            real_samples.append(real_sample)
-            imag_samples.append(imag_sample)
-        real_samples = torch.cat(real_samples, dim=1)
-        imag_samples = torch.cat(imag_samples, dim=1)
+        # all positions are measured at once; a factored n-gram mixture
+        # [real, imag, weight] shaped (batch_size, n, seq_len, ...) is summed over n
+        probs = self.measurement(inputs)
+        return self.collapse(probs)
+
+    def collapse(self, probs):
+        '''
+        Collapses measurement probabilities of shape (batch_size, seq_len, embed_dim)
+        onto the measurement states in one op.
+        '''
+        probs = probs.clamp(min=1e-5)
+        if self.method == 'sample':
+            # one draw per (batch, position); the random stream differs from
+            # the former per-position loop, the distribution does not
+            batch_size, seq_len, units = probs.shape
+            sampled_indice = probs.reshape(-1, units).multinomial(1).view(batch_size, seq_len)
+            real_samples = self.measurement.kernel[:,:,0][sampled_indice]
+            imag_samples = self.measurement.kernel[:,:,1][sampled_indice]
+
+        elif self.method == 'ensemble':
+            real_samples = torch.matmul(probs, self.measurement.kernel[:,:,0])
+            imag_samples = torch.matmul(probs, self.measurement.kernel[:,:,1])
         return [real_samples, imag_samples]
     
+def test():
+    from layers.complexnn.mixture import ComplexMixture
+    a = torch.randn(3, 5, 4, 6)
+    b = torch.randn(3, 5, 4, 6)
+    c = torch.softmax(torch.randn(3, 5, 4, 1), dim=1)
+    mixture = ComplexMixture()([a, b, c])
+    # ensemble: identical to measuring one position at a time
+    proj_measurement = ComplexProjMeasurement(None, 6, method='ensemble')
+    proj_measurement.measurement.kernel.data = torch.randn(6, 6, 2)
+    outputs = proj_measurement(mixture)
+    expected = [proj_measurement.collapse(proj_measurement.measurement([mixture[0][:,i], mixture[1][:,i]]).unsqueeze(1))
+                for i in range(4)]
+    passed = all(torch.allclose(outputs[j], torch.cat([e[j] for e in expected], dim=1), atol=1e-5) for j in range(2))
+
+    # sample: one measurement state per position, drawn with the measured probabilities
+    proj_measurement = ComplexProjMeasurement(None, 6, method='sample')
+    proj_measurement.measurement.kernel.data = torch.stack([torch.eye(6), torch.zeros(6, 6)], dim=-1)
+    outputs = proj_measurement(mixture)
+    passed = passed and all(output.shape == (3, 4, 6) for output in outputs)
+    probs = torch.tensor([0.5, 0.3, 0.1, 0.1, 0., 0.])
+    real_samples, _ = proj_measurement.collapse(probs.expand(2000, 5, 6))
+    frequencies = torch.bincount(real_samples.argmax(-1).view(-1), minlength=6).float() / 10000
+    passed = passed and torch.allclose(frequencies, probs, atol=0.02)
+    if passed:
+        print('ComplexProjMeasurement Test Passed.')
+    else:
+        print('ComplexProjMeasurement Test Failed.')
+
 if __name__ == '__main__':
-    pass
+    test()
     
     
     
@@ -2,12 +2,17 @@
 
 import torch
 import torch.nn.functional as F
+from layers.complexnn.utils import packed_outer_products
 
 class ComplexSuperposition(torch.nn.Module):
-
-    def __init__(self, average_weights = False):
+    '''
+    packed=True returns the pure-state density matrix in the packed Hermitian
+    layout of ComplexMixture(packed=True).
+    '''
+    def __init__(self, average_weights = False, packed = False):
         super(ComplexSuperposition, self).__init__()
         self. average_weights = average_weights
+        self.packed = packed
 
     def forward(self, inputs):
 
@@ -15,6 +20,9 @@ class ComplexSuperposition(torch.nn.Module):
             raise ValueError('This layer should be called '
                              'on a list of 2/3 inputs.')
 
+        if inputs[0].is_complex():
+            return self.complex_forward(inputs)
+
         if len(inputs) != 3 and len(inputs) != 2:
             raise ValueError('This layer should be called '
                             'on a list of 2/3 inputs.'
@@ -37,6 +45,9 @@ class ComplexSuperposition(torch.nn.Module):
             output_real = torch.sum(output_real, dim=1) #shape: (None, 300)
             output_imag = input_imag * weight
             output_imag = torch.sum(output_imag, dim=1)
+
+        if self.packed:
+            return packed_outer_products(output_real, output_imag)
         
         
         output_real_transpose = torch.unsqueeze(output_real, dim=1) #shape: (None, 1, 300)
@@ -50,6 +61,19 @@ class ComplexSuperposition(torch.nn.Module):
         output_i = torch.matmul(output_imag, output_real_transpose) - torch.matmul(output_real, output_imag_transpose) #shape: (None, 300, 300)
         return [output_r, output_i]
 
+    def complex_forward(self, inputs):
+        # inputs = [state] or [state, weight] with a torch.complex64 state
+        state = inputs[0]
+        if self.average_weights:
+            state = torch.mean(state, dim=1)
+        else:
+            weight = inputs[1]
+            if weight.dim() == 2:
+                weight = torch.unsqueeze(weight, dim=-1)
+            state = torch.sum(state * weight, dim=1)
+
+        return torch.unsqueeze(state, dim=-1) * torch.unsqueeze(state.conj(), dim=-2)
+
 def test():
     sup = ComplexSuperposition()
     a = torch.randn(4, 10, 2)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import torch
+
+def parameter_state(module, *params):
+    '''
+    A key that changes whenever tensors derived from params must be rebuilt:
+    when a parameter is updated in place or replaced, when the module switches
+    between train and eval mode, and, while gradients are enabled, after each
+    backward pass that reaches the parameters, so that a graph freed by
+    backward is never reused.
+    '''
+    grad_enabled = torch.is_grad_enabled()
+    key = [module.training, grad_enabled]
+    for param in params:
+        key += [param._version, param.data_ptr()]
+        if grad_enabled:
+            grad = param.grad
+            key += [None, None] if grad is None else [id(grad), grad._version]
+    return tuple(key)
+
+def to_complex(inputs):
+    '''
+    Adapter from the [real, imag] list format to torch.complex64 tensors.
+    A factored mixture [real, imag, weight] becomes [state, weight].
+    '''
+    if len(inputs) == 3:
+        return [torch.complex(inputs[0], inputs[1]), inputs[2]]
+    return torch.complex(inputs[0], inputs[1])
+
+def to_real_list(inputs):
+    '''
+    Adapter from torch.complex64 tensors back to the [real, imag] list format.
+    A factored mixture [state, weight] becomes [real, imag, weight].
+    '''
+    if isinstance(inputs, list):
+        return [inputs[0].real, inputs[0].imag, inputs[1]]
+    return [inputs.real, inputs.imag]
+
+@functools.lru_cache(maxsize=None)
+def hermitian_indices(embed_dim, device=torch.device('cpu')):
+    '''
+    Row and column indices of the packed Hermitian layout: the D(D-1)/2
+    strictly upper entries first, then the D diagonal entries. The packed
+    real part holds all D(D+1)/2 entries, the packed imaginary part only the
+    leading D(D-1)/2, since its diagonal is zero.
+    '''
+    rows, cols = torch.triu_indices(embed_dim, embed_dim, offset=1, device=device)
+    diagonal = torch.arange(embed_dim, device=device)
+    return torch.cat([rows, diagonal]), torch.cat([cols, diagonal])
+
+def packed_outer_products(input_real, input_imag):
+    '''
+    Upper triangles of psi*psi^H for states of shape (..., embed_dim),
+    returned packed as [(..., D(D+1)/2), (..., D(D-1)/2)].
+    '''
+    embed_dim = input_real.shape[-1]
+    rows, cols = hermitian_indices(embed_dim, input_real.device)
+    real_rows, real_cols = input_real[..., rows], input_real[..., cols]
+    imag_rows, imag_cols = input_imag[..., rows], input_imag[..., cols]
+    num_strict = embed_dim * (embed_dim - 1) // 2
+    output_real = real_rows * real_cols + imag_rows * imag_cols
+    output_imag = imag_rows[..., :num_strict] * real_cols[..., :num_strict] \
+        - real_rows[..., :num_strict] * imag_cols[..., :num_strict]
+    return [output_real, output_imag]
+
+def pack_hermitian(inputs):
+    '''
+    Adapter from full [real, imag] density matrices (..., D, D) to the packed layout.
+    '''
+    embed_dim = inputs[0].shape[-1]
+    rows, cols = hermitian_indices(embed_dim, inputs[0].device)
+    num_strict = embed_dim * (embed_dim - 1) // 2
+    return [inputs[0][..., rows, cols], inputs[1][..., rows[:num_strict], cols[:num_strict]]]
+
+def unpack_hermitian(inputs):
+    '''
+    Adapter from the packed layout back to full [real, imag] density matrices.
+    '''
+    packed_real, packed_imag = inputs
+    embed_dim = packed_real.shape[-1] - packed_imag.shape[-1]
+    rows, cols = hermitian_indices(embed_dim, packed_real.device)
+    num_strict = packed_imag.shape[-1]
+    shape = packed_real.shape[:-1] + (embed_dim, embed_dim)
+    output_real = packed_real.new_zeros(shape)
+    output_imag = packed_imag.new_zeros(shape)
+    output_real[..., rows, cols] = packed_real
+    output_real[..., cols, rows] = packed_real
+    output_imag[..., rows[:num_strict], cols[:num_strict]] = packed_imag
+    output_imag[..., cols[:num_strict], rows[:num_strict]] = -packed_imag
+    return [output_real, output_imag]
@@ -30,6 +30,9 @@ def setup(opt):
     
     
     print("network type: " + opt.network_type)
+    # the models whose forward takes the mask passed by run.py with padding_mask
+    if opt.__dict__.get('padding_mask', False) and opt.network_type not in ['qdnn']:
+        raise Exception("padding_mask is not supported by model: {}".format(opt.network_type))
     if opt.network_type == "real":
         model = RealNN(opt)
     elif opt.network_type == "qdnn":
@@ -63,3 +66,40 @@ def setup(opt):
     else:
         raise Exception("model not supported: {}".format(opt.network_type))
     return model
+
+def get_param_groups(model):
+    """
+    Parameter groups of model for the optimizer.*_Unitary optimizers: the
+    parameters tagged unitary, e.g. the ComplexMeasurement kernels, and the rest.
+    """
+    unitary_params = [p for p in model.parameters() if getattr(p, 'unitary', False)]
+    other_params = [p for p in model.parameters() if not getattr(p, 'unitary', False)]
+    return [{'params': params, 'unitary': unitary} for params, unitary
+            in [(unitary_params, True), (other_params, False)] if len(params) > 0]
+
+def setup_optimizer(opt, model):
+    import torch
+    from optimizer import RMSprop_Sparse, RMSprop_Unitary, SGD_Unitary, Adam_Unitary
+
+    if opt.__dict__.get('unitary_update', False):
+        # one optimizer, Cayley updates for the unitary group and Euclidean ones for the rest
+        if opt.__dict__.get('sparse_embedding', False):
+            raise Exception("sparse_embedding is not supported with unitary_update")
+        param_groups = get_param_groups(model)
+        # retraction = lazy re-orthonormalizes only once the drift exceeds drift_tolerance
+        options = dict(lr_unitary=opt.__dict__.get('lr_unitary', 0.01), lr=opt.lr,
+                       retraction=opt.__dict__.get('retraction', 'cayley'),
+                       drift_tolerance=opt.__dict__.get('drift_tolerance', 1e-3))
+        optimizer_type = opt.__dict__.get('optimizer', 'rmsprop')
+        if optimizer_type == 'rmsprop':
+            return RMSprop_Unitary(param_groups, **options)
+        elif optimizer_type == 'sgd':
+            return SGD_Unitary(param_groups, **options)
+        elif optimizer_type == 'adam':
+            return Adam_Unitary(param_groups, **options)
+        raise Exception("optimizer not supported: {}".format(optimizer_type))
+
+    if opt.__dict__.get('sparse_embedding', False):
+        # updates only the embedding rows of the batch
+        return RMSprop_Sparse(list(model.parameters()), lr=opt.lr)
+    return torch.optim.RMSprop(list(model.parameters()), lr=opt.lr)
@@ -9,7 +9,7 @@ class TextCNN(nn.Module):
         super(TextCNN, self).__init__()
         self.opt = opt
         embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
-        self.embed = nn.Embedding.from_pretrained(embedding_matrix, freeze=False)
+        self.embed = nn.Embedding.from_pretrained(embedding_matrix, freeze=False, sparse=opt.__dict__.get('sparse_embedding', False))
         self.channel_in = 1
         self.filter_num = 30
         self.conv11 = nn.Conv2d(self.channel_in, self.filter_num, (3, 50)) 
@@ -10,7 +10,7 @@ class ComplexFastText(nn.Module):
         super(ComplexFastText, self).__init__() 
         self.opt = opt
         embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
-        self.complex_embed = ComplexEmbedding(opt, embedding_matrix)
+        self.complex_embed = ComplexEmbedding(opt, embedding_matrix, sparse = opt.__dict__.get('sparse_embedding', False))
         self.l2_normalization = L2Normalization(dim=-1)
         self.multiply = ComplexMultiply()
         self.linear = nn.Linear(100, 400)
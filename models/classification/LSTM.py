@@ -9,7 +9,7 @@ class TextLSTM(nn.Module):
         super(TextLSTM, self).__init__()
         self.opt = opt
         embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
-        self.embed = nn.Embedding.from_pretrained(embedding_matrix, freeze=False)
+        self.embed = nn.Embedding.from_pretrained(embedding_matrix, freeze=False, sparse=opt.__dict__.get('sparse_embedding', False))
         self.lstm = nn.LSTM(50, 50, batch_first=True, bidirectional=True)
         self.fc = nn.Linear(100, 2)
 
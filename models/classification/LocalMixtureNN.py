@@ -25,17 +25,28 @@ class LocalMixtureNN(torch.nn.Module):
         if sentiment_lexicon is not None:
             sentiment_lexicon = torch.tensor(sentiment_lexicon, dtype=torch.float)
         self.ngram = nn.ModuleList([NGram(gram_n = int(n_value),device = self.device) for n_value in opt.ngram_value.split(',')])
+        # measure each token once and mix the probabilities over the n-gram windows
+        self.windowed_mixture = opt.__dict__.get('windowed_mixture', False)
+        self.local_mixture = LocalMixture([n_gram.gram_n for n_gram in self.ngram])
         self.pooling_type = opt.pooling_type
         self.num_measurements = opt.measurement_size
         self.embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
         self.embedding_dim = self.embedding_matrix.shape[1]
-        self.complex_embed = ComplexEmbedding(opt, self.embedding_matrix)
+        # row-sparse embedding gradients, see optimizer.RMSprop_Sparse
+        self.sparse_embedding = opt.__dict__.get('sparse_embedding', False)
+        self.complex_embed = complex_embedding(opt, self.embedding_matrix, sparse = self.sparse_embedding)
         self.l2_norm = L2Norm(dim = -1, keep_dims = True)
         self.l2_normalization = L2Normalization(dim = -1)
         self.activation = nn.Softmax(dim = 1)
-        self.complex_multiply = ComplexMultiply()
-        self.mixture = ComplexMixture(use_weights = True)
-        self.measurement = ComplexMeasurement(self.embedding_dim, units = 2*self.num_measurements,device = self.device)
+        # run the complex layers on torch.complex64 tensors instead of [real, imag] lists
+        self.complex_backend = opt.__dict__.get('complex_backend', False)
+        self.complex_multiply = ComplexMultiply(use_complex = self.complex_backend)
+        # norm, normalization and complex multiply in one op, the n-gram weights are softmaxed later
+        self.fused_front_end = opt.__dict__.get('fused_front_end', False)
+        self.front_end = ComplexFrontEnd(softmax = False, use_complex = self.complex_backend)
+        self.fused_measurement = opt.__dict__.get('fused_measurement', False)
+        self.mixture = ComplexMixture(use_weights = True, factored = self.fused_measurement or opt.__dict__.get('factored_mixture', False), packed = opt.__dict__.get('packed_density', False))
+        self.measurement = ComplexMeasurement(self.embedding_dim, units = 2*self.num_measurements,device = self.device, fused = self.fused_measurement)
         self.use_lexicon_as_measurement = opt.use_lexicon_as_measurement
         self.hidden_units = opt.hidden_units
         
@@ -74,23 +85,38 @@ class LocalMixtureNN(torch.nn.Module):
         """
         
         amplitude_embedding, phase_embedding  = self.complex_embed(input_seq)
-        weights = self.l2_norm(amplitude_embedding)
-        amplitude_embedding = self.l2_normalization(amplitude_embedding)
-        [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
+        if self.fused_front_end:
+            weights, seq_embedding = self.front_end([phase_embedding, amplitude_embedding])
+        else:
+            weights = self.l2_norm(amplitude_embedding)
+            amplitude_embedding = self.l2_normalization(amplitude_embedding)
+            seq_embedding = self.complex_multiply([phase_embedding, amplitude_embedding])
+        if not self.complex_backend:
+            [seq_embedding_real, seq_embedding_imag] = seq_embedding
         prob_list = []
-        for n_gram in self.ngram:
-            n_gram_embedding_real = n_gram(seq_embedding_real)
-            n_gram_embedding_imag = n_gram(seq_embedding_imag)
-            n_gram_weight = n_gram(weights)
-            n_gram_weight = self.activation(n_gram_weight)
-            
-            [sentence_embedding_real, sentence_embedding_imag] = self.mixture([n_gram_embedding_real, n_gram_embedding_imag,n_gram_weight])
-            
+        if self.windowed_mixture:
             mea_operator = None
             if self.use_lexicon_as_measurement:
                 amplitude_measure_operator, phase_measure_operator = self.complex_embed.sample(self.num_measurements)
                 mea_operator = self.complex_multiply([phase_measure_operator, amplitude_measure_operator])
-            prob_list.append(self.measurement([sentence_embedding_real, sentence_embedding_imag], measure_operator=mea_operator))
+            token_probs = self.measurement.measure_pure_states(seq_embedding, measure_operator=mea_operator)
+            prob_list = self.local_mixture([token_probs, weights])
+        else:
+            for n_gram in self.ngram:
+                n_gram_weight = n_gram(weights)
+                n_gram_weight = self.activation(n_gram_weight)
+                if self.complex_backend:
+                    sentence_embedding = self.mixture([n_gram(seq_embedding), n_gram_weight])
+                else:
+                    n_gram_embedding_real = n_gram(seq_embedding_real)
+                    n_gram_embedding_imag = n_gram(seq_embedding_imag)
+                    sentence_embedding = self.mixture([n_gram_embedding_real, n_gram_embedding_imag,n_gram_weight])
+                
+                mea_operator = None
+                if self.use_lexicon_as_measurement:
+                    amplitude_measure_operator, phase_measure_operator = self.complex_embed.sample(self.num_measurements)
+                    mea_operator = self.complex_multiply([phase_measure_operator, amplitude_measure_operator])
+                prob_list.append(self.measurement(sentence_embedding, measure_operator=mea_operator))
         
         probs_tensor = torch.stack(prob_list,dim = -1)
         probs_feature = []
@@ -30,19 +30,28 @@ class MLLM(torch.nn.Module):
             
         self.num_hidden_layers = len(str(opt.ngram_value).split(','))-1
         self.ngram = nn.ModuleList([NGram(gram_n = int(n_value),device = self.device) for n_value in str(opt.ngram_value).split(',') if len(n_value)>0 ])
+        # measure each token once and mix the probabilities over the n-gram windows
+        self.windowed_mixture = opt.__dict__.get('windowed_mixture', False)
+        self.local_mixtures = nn.ModuleList([LocalMixture([n_gram.gram_n]) for n_gram in self.ngram])
         self.pooling_type = opt.pooling_type
         self.num_measurements = opt.measurement_size
         self.embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
         self.embedding_dim = self.embedding_matrix.shape[1]
-        self.complex_embed = ComplexEmbedding(opt, self.embedding_matrix)
+        # row-sparse embedding gradients, see optimizer.RMSprop_Sparse
+        self.sparse_embedding = opt.__dict__.get('sparse_embedding', False)
+        self.complex_embed = complex_embedding(opt, self.embedding_matrix, sparse = self.sparse_embedding)
         self.l2_norm = L2Norm(dim = -1, keep_dims = True)
         self.l2_normalization = L2Normalization(dim = -1)
         self.activation = nn.Softmax(dim = 1)
         self.complex_multiply = ComplexMultiply()
-        self.mixture = ComplexMixture(use_weights = True)
+        # norm, normalization and complex multiply in one op, the n-gram weights are softmaxed later
+        self.fused_front_end = opt.__dict__.get('fused_front_end', False)
+        self.front_end = ComplexFrontEnd(softmax = False)
+        self.fused_measurement = opt.__dict__.get('fused_measurement', False)
+        self.mixture = ComplexMixture(use_weights = True, factored = self.fused_measurement)
         self.final_mixture = ComplexMixture(use_weights= False)
-        self.proj_measurements = nn.ModuleList([ComplexProjMeasurement(opt, self.embedding_dim, device = self.device) for i in range(self.num_hidden_layers)])
-        self.measurement = ComplexMeasurement(self.embedding_dim, units = self.num_measurements,device = self.device)
+        self.proj_measurements = nn.ModuleList([ComplexProjMeasurement(opt, self.embedding_dim, device = self.device, fused = self.fused_measurement) for i in range(self.num_hidden_layers)])
+        self.measurement = ComplexMeasurement(self.embedding_dim, units = self.num_measurements,device = self.device, fused = self.fused_measurement)
         self.use_lexicon_as_measurement = opt.use_lexicon_as_measurement
         self.hidden_units = opt.hidden_units
 
@@ -56,29 +65,37 @@ class MLLM(torch.nn.Module):
         """
         
         amplitude_embedding, phase_embedding  = self.complex_embed(input_seq)
-        weights = self.l2_norm(amplitude_embedding)
-        amplitude_embedding = self.l2_normalization(amplitude_embedding)
-        [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
+        if self.fused_front_end:
+            weights, [seq_embedding_real, seq_embedding_imag] = self.front_end([phase_embedding, amplitude_embedding])
+        else:
+            weights = self.l2_norm(amplitude_embedding)
+            amplitude_embedding = self.l2_normalization(amplitude_embedding)
+            [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
         for i in range(self.num_hidden_layers):
-            n_gram = self.ngram[i]
-            real_n_gram_embed = n_gram(seq_embedding_real)
-            imag_n_gram_embed = n_gram(seq_embedding_imag)
-            n_gram_weight = n_gram(weights)
-            # weights = torch.sum(n_gram_weight, dim=1)
-            n_gram_weight = self.activation(n_gram_weight)
-            [sentence_embedding_real, sentence_embedding_imag] = self.mixture([real_n_gram_embed, imag_n_gram_embed, n_gram_weight])
-            [seq_embedding_real, seq_embedding_imag] = self.proj_measurements[i]([sentence_embedding_real, sentence_embedding_imag])
+            if self.windowed_mixture:
+                token_probs = self.proj_measurements[i].measurement.measure_pure_states([seq_embedding_real, seq_embedding_imag])
+                [probs] = self.local_mixtures[i]([token_probs, weights])
+                [seq_embedding_real, seq_embedding_imag] = self.proj_measurements[i].collapse(probs)
+            else:
+                n_gram = self.ngram[i]
+                real_n_gram_embed = n_gram(seq_embedding_real)
+                imag_n_gram_embed = n_gram(seq_embedding_imag)
+                n_gram_weight = n_gram(weights)
+                # weights = torch.sum(n_gram_weight, dim=1)
+                n_gram_weight = self.activation(n_gram_weight)
+                sentence_embedding = self.mixture([real_n_gram_embed, imag_n_gram_embed, n_gram_weight])
+                [seq_embedding_real, seq_embedding_imag] = self.proj_measurements[i](sentence_embedding)
 
 #        n_gram = self.ngram[self.num_hidden_layers]
 #        n_gram_weight = n_gram(weights)
 #        real_n_gram_embed = n_gram(seq_embedding_real)
 #        imag_n_gram_embed = n_gram(seq_embedding_imag)
-        [sentence_embedding_real, sentence_embedding_imag] = self.mixture([seq_embedding_real, seq_embedding_imag, weights])
+        sentence_embedding = self.mixture([seq_embedding_real, seq_embedding_imag, weights])
         mea_operator = None
         if self.use_lexicon_as_measurement:
             amplitude_measure_operator, phase_measure_operator = self.complex_embed.sample(self.num_measurements)
             mea_operator = self.complex_multiply([phase_measure_operator, amplitude_measure_operator])
-        output = self.measurement([sentence_embedding_real, sentence_embedding_imag], measure_operator=mea_operator)
+        output = self.measurement(sentence_embedding, measure_operator=mea_operator)
 #        output = torch.log10(output)
         output = self.dense(output)
 #        output = self.measurement([sentence_embedding_real, sentence_embedding_imag])
@@ -22,39 +22,66 @@ class QDNN(torch.nn.Module):
         self.num_measurements = opt.measurement_size
         self.embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
         self.embedding_dim = self.embedding_matrix.shape[1]
-        self.complex_embed = ComplexEmbedding(opt,self.embedding_matrix)
+        # row-sparse embedding gradients, see optimizer.RMSprop_Sparse
+        self.sparse_embedding = opt.__dict__.get('sparse_embedding', False)
+        self.complex_embed = complex_embedding(opt, self.embedding_matrix, sparse = self.sparse_embedding)
         self.l2_norm = L2Norm(dim = -1, keep_dims = True)
         self.l2_normalization = L2Normalization(dim = -1)
         self.activation = nn.Softmax(dim = 1)
-        self.complex_multiply = ComplexMultiply()
-        self.mixture = ComplexMixture(use_weights = True)
-        self.measurement = ComplexMeasurement(self.embedding_dim, units = 2*self.num_measurements,device = self.device)
+        # run the complex layers on torch.complex64 tensors instead of [real, imag] lists
+        self.complex_backend = opt.__dict__.get('complex_backend', False)
+        self.complex_multiply = ComplexMultiply(use_complex = self.complex_backend)
+        # norm, normalization, softmax and complex multiply in one op
+        self.fused_front_end = opt.__dict__.get('fused_front_end', False)
+        self.front_end = ComplexFrontEnd(softmax = True, use_complex = self.complex_backend)
+        self.fused_measurement = opt.__dict__.get('fused_measurement', False)
+        self.mixture = ComplexMixture(use_weights = True, factored = self.fused_measurement or opt.__dict__.get('factored_mixture', False), packed = opt.__dict__.get('packed_density', False))
+        self.measurement = ComplexMeasurement(self.embedding_dim, units = 2*self.num_measurements,device = self.device, fused = self.fused_measurement)
         self.dense = nn.Linear(in_features = 2*self.num_measurements, out_features = 2)
         self.use_lexicon_as_measurement = opt.use_lexicon_as_measurement
 
         
-    def forward(self, input_seq):
+    def forward(self, input_seq, mask=None):
         """
         In the forward function we accept a Variable of input data and we must 
         return a Variable of output data. We can use Modules defined in the 
         constructor as well as arbitrary operators on Variables.
+        mask: optional (batch_size, seq_len) bool tensor of the non-padded positions.
         """
         
         amplitude_embedding, phase_embedding  = self.complex_embed(input_seq)
 #        phase_embedding = self.phase_embedding_layer(input_seq)
 #        amplitude_embedding = self.amplitude_embedding_layer(input_seq)
-        weights = self.l2_norm(amplitude_embedding)
-        amplitude_embedding = self.l2_normalization(amplitude_embedding)
-        weights = self.activation(weights)
-        [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
-        [sentence_embedding_real, sentence_embedding_imag] = self.mixture([seq_embedding_real, seq_embedding_imag,weights])
+        if self.fused_front_end:
+            weights, seq_embedding = self.front_end([phase_embedding, amplitude_embedding], mask=mask)
+        else:
+            weights = self.l2_norm(amplitude_embedding)
+            amplitude_embedding = self.l2_normalization(amplitude_embedding)
+            if mask is not None:
+                # padded positions get zero weight in the softmax
+                weights = weights.masked_fill(~torch.unsqueeze(mask, dim=-1), float('-inf'))
+            weights = self.activation(weights)
+            seq_embedding = self.complex_multiply([phase_embedding, amplitude_embedding])
+        if self.complex_backend:
+            if mask is None:
+                sentence_embedding = self.mixture([seq_embedding, weights])
+            else:
+                # the mixture skips the outer products of padded positions
+                sentence_embedding = self.mixture([seq_embedding, weights, mask])
+        else:
+            [seq_embedding_real, seq_embedding_imag] = seq_embedding
+            if mask is None:
+                sentence_embedding = self.mixture([seq_embedding_real, seq_embedding_imag,weights])
+            else:
+                # the mixture skips the outer products of padded positions
+                sentence_embedding = self.mixture([seq_embedding_real, seq_embedding_imag, weights, mask])
         
         mea_operator = None
         if self.use_lexicon_as_measurement:
             amplitude_measure_operator, phase_measure_operator = self.complex_embed.sample(self.num_measurements)
             mea_operator = self.complex_multiply([phase_measure_operator, amplitude_measure_operator])
         
-        output = self.measurement([sentence_embedding_real, sentence_embedding_imag], measure_operator=mea_operator)
+        output = self.measurement(sentence_embedding, measure_operator=mea_operator)
 #        output = torch.log10(output)
         output = self.dense(output)
 #        output = self.measurement([sentence_embedding_real, sentence_embedding_imag])
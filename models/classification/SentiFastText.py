@@ -13,7 +13,7 @@ class SentiFastText(nn.Module):
             self.sentiment_lexicon = torch.tensor(sentiment_lexicon, dtype=torch.float).to(opt.device)
             self.sentiment_mask = torch.abs(self.sentiment_lexicon)
         embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
-        self.embed = nn.Embedding(embedding_matrix.shape[0], embedding_matrix.shape[1])
+        self.embed = nn.Embedding(embedding_matrix.shape[0], embedding_matrix.shape[1], sparse=opt.__dict__.get('sparse_embedding', False))
         self.linear = nn.Linear(50, 200)
         self.bn = nn.BatchNorm1d(200)
         self.fc = nn.Linear(200, 2)
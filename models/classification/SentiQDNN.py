@@ -19,13 +19,19 @@ class SentiQDNN(torch.nn.Module):
         self.num_measurements = opt.measurement_size
         self.embedding_matrix = torch.tensor(opt.lookup_table, dtype=torch.float)
         self.embedding_dim = self.embedding_matrix.shape[1]
-        self.complex_embed = ComplexEmbedding(opt, self.embedding_matrix)
+        # row-sparse embedding gradients, see optimizer.RMSprop_Sparse
+        self.sparse_embedding = opt.__dict__.get('sparse_embedding', False)
+        self.complex_embed = complex_embedding(opt, self.embedding_matrix, sparse = self.sparse_embedding)
         self.l2_norm = L2Norm(dim = -1, keep_dims = True)
         self.l2_normalization = L2Normalization(dim = -1)
         self.activation = nn.Softmax(dim = 1)
         self.complex_multiply = ComplexMultiply()
-        self.mixture = ComplexMixture(use_weights = True)
-        self.measurement = ComplexMeasurement(self.embedding_dim, units = self.num_measurements,device = self.device)
+        # norm, normalization, softmax and complex multiply in one op
+        self.fused_front_end = opt.__dict__.get('fused_front_end', False)
+        self.front_end = ComplexFrontEnd(softmax = True)
+        self.fused_measurement = opt.__dict__.get('fused_measurement', False)
+        self.mixture = ComplexMixture(use_weights = True, factored = self.fused_measurement or opt.__dict__.get('factored_mixture', False), packed = opt.__dict__.get('packed_density', False))
+        self.measurement = ComplexMeasurement(self.embedding_dim, units = self.num_measurements,device = self.device, fused = self.fused_measurement)
         self.dense = nn.Linear(self.num_measurements, 2)
         self.senti_dense = nn.Linear(self.embedding_dim, 1)
 
@@ -37,13 +43,16 @@ class SentiQDNN(torch.nn.Module):
         """
         
         amplitude_embedding, phase_embedding  = self.complex_embed(input_seq)
-        weights = self.l2_norm(amplitude_embedding)
-        amplitude_embedding = self.l2_normalization(amplitude_embedding)
-        weights = self.activation(weights)
-        [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
-        [sentence_embedding_real, sentence_embedding_imag] = self.mixture([seq_embedding_real, seq_embedding_imag,weights])
+        if self.fused_front_end:
+            weights, [seq_embedding_real, seq_embedding_imag] = self.front_end([phase_embedding, amplitude_embedding])
+        else:
+            weights = self.l2_norm(amplitude_embedding)
+            amplitude_embedding = self.l2_normalization(amplitude_embedding)
+            weights = self.activation(weights)
+            [seq_embedding_real, seq_embedding_imag] = self.complex_multiply([phase_embedding, amplitude_embedding])
+        sentence_embedding = self.mixture([seq_embedding_real, seq_embedding_imag,weights])
         
-        output = self.measurement([sentence_embedding_real, sentence_embedding_imag])
+        output = self.measurement(sentence_embedding)
         output = self.dense(output)
         
         indices = input_seq.flatten(0, 1)
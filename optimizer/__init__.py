@@ -2,4 +2,6 @@
 
 from .sgd_unitary import SGD_Unitary
 from .vanilla_unitary import Vanilla_Unitary
-from .rmsprop_unitary import RMSprop_Unitary
\ No newline at end of file
+from .rmsprop_unitary import RMSprop_Unitary
+from .rmsprop_sparse import RMSprop_Sparse
+from .adam_unitary import Adam_Unitary
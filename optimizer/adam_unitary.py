@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import math
+import torch
+from torch.optim.optimizer import Optimizer
+from .manifold import riemannian_adam_step, foreach_riemannian_adam_step, is_unitary, manifold_update
+
+
+class Adam_Unitary(Optimizer):
+    """Implements Adam with a Riemannian update for unitary matrices.
+
+    Args:
+        params (iterable): iterable of parameters to optimize or dicts defining
+            parameter groups
+        lr_unitary (float): step size of the Cayley retraction of unitary parameters
+        lr (float): learning rate of the other parameters
+        betas (Tuple[float, float]): coefficients of the running averages of
+            the gradient and its square
+        eps (float): term added to the denominator for numerical stability
+        weight_decay (float): L2 penalty of the other parameters
+        unitary (bool, optional): whether the parameters of a group are
+            (units, embed_dim, 2) kernels with orthonormal rows. By default,
+            only the parameters tagged p.unitary = True are
+        foreach (bool): step the unitary parameters of a group together, one
+            batched update per parameter shape
+        retraction (str): 'cayley', or 'lazy' for plain steps that are
+            re-orthonormalized only once the estimated drift ||W*W^H - I||
+            exceeds drift_tolerance, see manifold.lazy_update
+        drift_tolerance (float): drift that triggers the re-orthonormalization
+        drift_probes (int): random probes of the drift estimate
+        orthonormalization (str): 'qr' or 'polar'
+
+    .. note::
+        Non-unitary parameters get the update of torch.optim.Adam, so one
+        optimizer can train the measurement kernels and the rest of the model.
+        Unitary parameters follow G. Becigneul and O.-E. Ganea. Riemannian adaptive
+        optimization methods. In ICLR 2019: the moments are kept in the tangent
+        space and the first moment is transported along the retraction.
+
+        .. math::
+                  g = P_W(G) \\
+                  m = beta1*m + (1-beta1)*g,  v = beta2*v + (1-beta2)*|g|^2 \\
+                  W_new = W*(I+lr/2 * A)*(I-lr/2 * A)^(-1),  A from P_W(m_hat/(sqrt(v_hat)+eps)) \\
+                  m = P_{W_new}(m)
+
+        where P_W is the projection onto the tangent space at W, see
+        manifold.riemannian_adam_update.
+    """
+
+    def __init__(self, params, lr_unitary=1e-2, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0,
+                 unitary=None, foreach=False, retraction='cayley', drift_tolerance=1e-3, drift_probes=4, orthonormalization='qr'):
+        if not 0.0 <= lr_unitary:
+            raise ValueError("Invalid unitary learning rate: {}".format(lr_unitary))
+        if not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if not 0.0 <= eps:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 <= betas[0] < 1.0:
+            raise ValueError("Invalid beta parameter at index 0: {}".format(betas[0]))
+        if not 0.0 <= betas[1] < 1.0:
+            raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if retraction not in ('cayley', 'lazy'):
+            raise ValueError("Invalid retraction: {}".format(retraction))
+        if orthonormalization not in ('qr', 'polar'):
+            raise ValueError("Invalid orthonormalization: {}".format(orthonormalization))
+
+        defaults = dict(lr_unitary=lr_unitary, lr=lr, betas=betas, eps=eps, weight_decay=weight_decay,
+                        unitary=unitary, foreach=foreach,
+                        retraction=retraction, drift_tolerance=drift_tolerance, drift_probes=drift_probes, orthonormalization=orthonormalization)
+        super(Adam_Unitary, self).__init__(params, defaults)
+
+    def __setstate__(self, state):
+        super(Adam_Unitary, self).__setstate__(state)
+        for group in self.param_groups:
+            group.setdefault('unitary', None)
+            group.setdefault('retraction', 'cayley')
+            group.setdefault('drift_tolerance', 1e-3)
+            group.setdefault('drift_probes', 4)
+            group.setdefault('orthonormalization', 'qr')
+            group.setdefault('foreach', False)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step.
+
+        Arguments:
+            closure (callable, optional): A closure that reevaluates the model
+                and returns the loss.
+        """
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            params, grads, exp_avgs, exp_avg_sqs, steps = [], [], [], [], []
+            update = manifold_update(group)
+
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if p.grad.is_sparse:
+                    raise RuntimeError('Adam_Unitary does not support sparse gradients')
+                state = self.state[p]
+
+                unitary = is_unitary(p, group)
+
+                # State initialization
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p)
+                    # one second moment per complex entry of a unitary kernel
+                    state['exp_avg_sq'] = torch.zeros_like(p[..., 0] if unitary else p)
+
+                state['step'] += 1
+
+                if not unitary:
+                    self._euclidean_update(p, p.grad, group, state)
+                elif group['foreach']:
+                    params.append(p)
+                    grads.append(p.grad)
+                    exp_avgs.append(state['exp_avg'])
+                    exp_avg_sqs.append(state['exp_avg_sq'])
+                    steps.append(state['step'])
+                else:
+                    riemannian_adam_step(p, p.grad, state['exp_avg'], state['exp_avg_sq'], state['step'],
+                                         group['lr_unitary'], group['betas'], group['eps'], update)
+
+            if params:
+                foreach_riemannian_adam_step(params, grads, exp_avgs, exp_avg_sqs, steps,
+                                             group['lr_unitary'], group['betas'], group['eps'], update)
+
+        return loss
+
+    def _euclidean_update(self, p, grad, group, state):
+        beta1, beta2 = group['betas']
+        if group['weight_decay'] != 0:
+            grad = grad.add(p, alpha=group['weight_decay'])
+
+        exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        bias_correction1 = 1 - beta1 ** state['step']
+        bias_correction2 = 1 - beta2 ** state['step']
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+        p.addcdiv_(exp_avg, denom, value=-group['lr'] / bias_correction1)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import functools
+import torch
+
+
+def complex_view(tensor):
+    """(..., 2) real tensor as a complex tensor sharing its memory."""
+    return torch.view_as_complex(tensor if tensor.stride(-1) == 1 else tensor.contiguous())
+
+
+def is_unitary(p, group):
+    """Whether p takes the manifold update: the 'unitary' flag of its group if set, else the tag p.unitary."""
+    if group.get('unitary') is None:
+        return getattr(p, 'unitary', False)
+    return group['unitary']
+
+
+def skew_matrix(W, G):
+    """A = G^H*W - W^H*G for complex W and G."""
+    return torch.matmul(G.conj().transpose(-2, -1), W) - torch.matmul(W.conj().transpose(-2, -1), G)
+
+
+def cayley_update(W, G, lr):
+    """Cayley update of complex parameters W (..., units, embed_dim) with orthonormal rows and gradients G.
+
+    .. math::
+              A = G^H*W - W^H*G \\
+              W_new = W*(I+lr/2 * A)*(I-lr/2 * A)^(-1)
+
+    a descent step, W - lr * riemannian_gradient(W, G) to first order in lr,
+    for square and non-square kernels alike. Kernels with 2*units < embed_dim
+    take lowrank_cayley_update, the others dense_cayley_update. Leading
+    dimensions are batched into one solve.
+    """
+    if 2 * W.shape[-2] < W.shape[-1]:
+        return lowrank_cayley_update(W, G, lr)
+    return dense_cayley_update(W, G, lr)
+
+
+def dense_cayley_update(W, G, lr):
+    """cayley_update with the (embed_dim, embed_dim) system.
+
+    With X = W^H, X_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*X and W_new = X_new^H.
+    """
+    A_skew = skew_matrix(W, G)
+    X = W.conj().transpose(-2, -1)
+    identity = torch.eye(A_skew.shape[-1], dtype=A_skew.dtype, device=A_skew.device)
+    X_new = torch.linalg.solve(identity + (lr/2) * A_skew, torch.matmul(identity - (lr/2) * A_skew, X))
+    return X_new.conj().transpose(-2, -1)
+
+
+def lowrank_cayley_update(W, G, lr):
+    """cayley_update with a (2*units, 2*units) system.
+
+    With X = W^H, the (embed_dim, units) matrix of orthonormal columns,
+
+    .. math::
+              A = G^H*W - W^H*G = U*V^H,  U = [G^H, X],  V = [X, -G^H] \\
+              X_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*X
+                    = X - lr * U*(I+lr/2 * V^H*U)^(-1)*V^H*X
+
+    by the Sherman-Morrison-Woodbury identity, O(embed_dim*units^2) per step,
+    and W_new = X_new^H as in dense_cayley_update.
+    """
+    X = W.conj().transpose(-2, -1)
+    G_H = G.conj().transpose(-2, -1)
+    U = torch.cat([G_H, X], dim=-1)
+    V_H = torch.cat([X, -G_H], dim=-1).conj().transpose(-2, -1)
+    identity = torch.eye(U.shape[-1], dtype=U.dtype, device=U.device)
+    X_new = X - lr * torch.matmul(U, torch.linalg.solve(identity + (lr/2) * torch.matmul(V_H, U), torch.matmul(V_H, X)))
+    return X_new.conj().transpose(-2, -1)
+
+
+def riemannian_gradient(W, G):
+    """G - W*G^H*W, the gradient under the canonical metric for W with orthonormal rows.
+
+    The Cayley step of cayley_update is W - lr * riemannian_gradient(W, G)
+    to first order in lr.
+    """
+    return G - torch.matmul(W, torch.matmul(G.conj().transpose(-2, -1), W))
+
+
+def orthogonality_drift(W, num_probes=4):
+    """Estimate of ||W*W^H - I||_F for complex W (..., units, embed_dim), shaped (...).
+
+    For probes z with independent entries, E|z_i|^2 = 1, E||(W*W^H - I)*z||^2
+    equals ||W*W^H - I||_F^2, so each probe costs two matrix-vector products
+    instead of the (units, units) Gram matrix.
+    """
+    probes = torch.randn(W.shape[:-1] + (num_probes,), dtype=W.dtype, device=W.device)
+    residual = torch.matmul(W, torch.matmul(W.conj().transpose(-2, -1), probes)) - probes
+    return torch.sqrt(torch.sum(residual.real**2 + residual.imag**2, dim=(-2, -1)) / num_probes)
+
+
+def orthonormalize(W, method='qr'):
+    """The rows of complex W (..., units, embed_dim) made orthonormal again.
+
+    method 'qr' takes the Q factor of W^H, with the phases fixed so that R has
+    a positive real diagonal, method 'polar' the polar factor U*V^H of the SVD,
+    the closest matrix with orthonormal rows.
+    """
+    if method == 'polar':
+        U, _, V_H = torch.linalg.svd(W, full_matrices=False)
+        return torch.matmul(U, V_H)
+    Q, R = torch.linalg.qr(W.conj().transpose(-2, -1))
+    diagonal = torch.diagonal(R, dim1=-2, dim2=-1)
+    Q = Q * torch.unsqueeze(diagonal / torch.clamp(diagonal.abs(), min=1e-12), dim=-2)
+    return Q.conj().transpose(-2, -1)
+
+
+def lazy_update(W, G, lr, tolerance=1e-3, num_probes=4, method='qr'):
+    """W - lr * riemannian_gradient(W, G), re-orthonormalized only once it drifts off the manifold.
+
+    Parameters whose orthogonality_drift exceeds tolerance are orthonormalized
+    with the given method, the others keep the plain step, which is free of
+    any solve or factorization.
+    """
+    W_new = W - lr * riemannian_gradient(W, G)
+    drift = orthogonality_drift(W_new, num_probes)
+    if W_new.dim() == 2:
+        if drift.item() > tolerance:
+            W_new = orthonormalize(W_new, method)
+        return W_new
+    drifted = drift > tolerance
+    if drifted.any():
+        W_new[drifted] = orthonormalize(W_new[drifted], method)
+    return W_new
+
+
+def manifold_update(group):
+    """The update function of a parameter group, cayley_update or, for retraction='lazy', lazy_update."""
+    if group.get('retraction', 'cayley') == 'lazy':
+        return functools.partial(lazy_update, tolerance=group['drift_tolerance'],
+                                 num_probes=group['drift_probes'], method=group['orthonormalization'])
+    return cayley_update
+
+
+def optimizer_drift(optimizer, num_probes=4):
+    """The largest orthogonality_drift among the unitary parameters of optimizer, as a float."""
+    drifts = [orthogonality_drift(torch.view_as_complex(p.data), num_probes).item()
+              for group in optimizer.param_groups for p in group['params'] if is_unitary(p, group)]
+    return max(drifts) if len(drifts) > 0 else 0.
+
+
+@torch.no_grad()
+def cayley_step(p, d_p, lr, update=cayley_update):
+    """cayley_update of a (units, embed_dim, 2) parameter p with update direction d_p, in place.
+
+    d_p is a gradient, possibly preconditioned or averaged, never negated
+    nor scaled by a learning rate: the step moves against it by lr, as
+    p - lr*d_p does for Euclidean parameters. All unitary optimizers pass
+    d_p this way.
+    The system is solved with torch.linalg.solve on the device of p, and p
+    keeps its storage, so optimizer state and references to it stay valid.
+    Another update function of the same signature, e.g. from manifold_update,
+    can be given as update.
+    p is written under no_grad rather than through p.data, so that its
+    version counter moves and the caches keyed on it, such as the projectors
+    of ComplexMeasurement, are rebuilt.
+    """
+    W = torch.view_as_complex(p)
+    W.copy_(update(W, complex_view(d_p), lr))
+
+
+@torch.no_grad()
+def lowrank_cayley_step(p, d_p, lr):
+    """lowrank_cayley_update of a (units, embed_dim, 2) parameter p, in place."""
+    W = torch.view_as_complex(p)
+    W.copy_(lowrank_cayley_update(W, complex_view(d_p), lr))
+
+
+@torch.no_grad()
+def foreach_cayley_step(params, d_ps, lr, update=cayley_update):
+    """cayley_step of several parameters, with one batched solve per parameter shape."""
+    groups = {}
+    for p, d_p in zip(params, d_ps):
+        groups.setdefault((tuple(p.shape), p.dtype, p.device), []).append((p, d_p))
+    for pairs in groups.values():
+        W = torch.stack([torch.view_as_complex(p) for p, _ in pairs])
+        G = torch.stack([complex_view(d_p) for _, d_p in pairs])
+        for (p, _), W_new in zip(pairs, update(W, G, lr)):
+            torch.view_as_complex(p).copy_(W_new)
+
+
+def tangent_projection(W, Z):
+    """Projection of Z onto the tangent space at W of the manifold of orthonormal rows.
+
+    .. math::
+              P_W(Z) = Z - sym(Z*W^H)*W,  sym(M) = (M + M^H)/2
+    """
+    M = torch.matmul(Z, W.conj().transpose(-2, -1))
+    return Z - torch.matmul((M + M.conj().transpose(-2, -1)) / 2, W)
+
+
+def riemannian_adam_update(W, G, exp_avg, exp_avg_sq, bias_correction1, bias_correction2, lr, betas, eps,
+                           update=cayley_update):
+    """Riemannian Adam update of complex parameters W (..., units, embed_dim) with gradients G.
+
+    .. math::
+              g = P_W(G) \\
+              m = beta1*m + (1-beta1)*g,  v = beta2*v + (1-beta2)*|g|^2 \\
+              W_new = cayley_update(W, P_W(m_hat/(sqrt(v_hat)+eps)), lr) \\
+              m = P_{W_new}(m)
+
+    The complex first moment exp_avg and the real second moment exp_avg_sq
+    are updated in place, the first moment is transported to W_new by
+    projection. The bias corrections broadcast against the leading dimensions.
+    update replaces cayley_update as the retraction.
+    """
+    beta1, beta2 = betas
+    grad = tangent_projection(W, G)
+    exp_avg.mul_(beta1).add_(grad * (1 - beta1))
+    exp_avg_sq.mul_(beta2).add_((grad.real**2 + grad.imag**2) * (1 - beta2))
+    denom = (exp_avg_sq / bias_correction2).sqrt().add_(eps)
+    direction = tangent_projection(W, exp_avg / bias_correction1 / denom)
+    W_new = update(W, direction, lr)
+    exp_avg.copy_(tangent_projection(W_new, exp_avg))
+    return W_new
+
+
+@torch.no_grad()
+def riemannian_adam_step(p, grad, exp_avg, exp_avg_sq, step, lr, betas, eps, update=cayley_update):
+    """riemannian_adam_update of a (units, embed_dim, 2) parameter p, in place.
+
+    exp_avg has the shape of p, exp_avg_sq that of p[:,:,0].
+    """
+    W = torch.view_as_complex(p)
+    W.copy_(riemannian_adam_update(W, complex_view(grad), torch.view_as_complex(exp_avg), exp_avg_sq,
+                                   1 - betas[0] ** step, 1 - betas[1] ** step, lr, betas, eps, update))
+
+
+@torch.no_grad()
+def foreach_riemannian_adam_step(params, grads, exp_avgs, exp_avg_sqs, steps, lr, betas, eps, update=cayley_update):
+    """riemannian_adam_step of several parameters, batched per parameter shape."""
+    groups = {}
+    for i, p in enumerate(params):
+        groups.setdefault((tuple(p.shape), p.dtype, p.device), []).append(i)
+    for indices in groups.values():
+        W = torch.stack([torch.view_as_complex(params[i]) for i in indices])
+        G = torch.stack([complex_view(grads[i]) for i in indices])
+        exp_avg = torch.stack([torch.view_as_complex(exp_avgs[i]) for i in indices])
+        exp_avg_sq = torch.stack([exp_avg_sqs[i] for i in indices])
+        step = torch.tensor([steps[i] for i in indices], dtype=exp_avg_sq.dtype, device=exp_avg_sq.device).view(-1, 1, 1)
+        W_new = riemannian_adam_update(W, G, exp_avg, exp_avg_sq, 1 - betas[0] ** step, 1 - betas[1] ** step, lr, betas, eps, update)
+        for j, i in enumerate(indices):
+            torch.view_as_complex(params[i]).copy_(W_new[j])
+            torch.view_as_complex(exp_avgs[i]).copy_(exp_avg[j])
+            exp_avg_sqs[i].copy_(exp_avg_sq[j])
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import torch
+from torch.optim.optimizer import Optimizer
+
+
+class RMSprop_Sparse(Optimizer):
+    """Implements RMSprop with lazy row updates for sparse gradients.
+
+    Args:
+        params (iterable): iterable of parameters to optimize or dicts defining
+            parameter groups
+        lr (float): learning rate
+        alpha (float): smoothing constant of the squared gradient average
+        eps (float): term added to the denominator for numerical stability
+        weight_decay (float): L2 penalty
+        momentum (float): momentum factor
+        centered (bool): normalize by the estimated variance of the gradient
+
+    .. note::
+        Dense gradients get the update of torch.optim.RMSprop. For row-sparse
+        gradients, e.g. of embeddings created with sparse=True, only the rows
+        present in the gradient are updated, together with their square_avg,
+        grad_avg and momentum_buffer rows. The state of the other rows is not
+        decayed in that step, as in lazy Adam.
+    """
+
+    def __init__(self, params, lr=1e-2, alpha=0.99, eps=1e-8, weight_decay=0, momentum=0, centered=False):
+        if not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if not 0.0 <= eps:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 <= momentum:
+            raise ValueError("Invalid momentum value: {}".format(momentum))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if not 0.0 <= alpha:
+            raise ValueError("Invalid alpha value: {}".format(alpha))
+
+        defaults = dict(lr=lr, alpha=alpha, eps=eps, weight_decay=weight_decay, momentum=momentum, centered=centered)
+        super(RMSprop_Sparse, self).__init__(params, defaults)
+
+    def __setstate__(self, state):
+        super(RMSprop_Sparse, self).__setstate__(state)
+        for group in self.param_groups:
+            group.setdefault('momentum', 0)
+            group.setdefault('centered', False)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step.
+
+        Arguments:
+            closure (callable, optional): A closure that reevaluates the model
+                and returns the loss.
+        """
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                state = self.state[p]
+
+                # State initialization
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['square_avg'] = torch.zeros_like(p)
+                    if group['momentum'] > 0:
+                        state['momentum_buffer'] = torch.zeros_like(p)
+                    if group['centered']:
+                        state['grad_avg'] = torch.zeros_like(p)
+
+                state['step'] += 1
+
+                if p.grad.is_sparse:
+                    self._sparse_update(p, p.grad.coalesce(), group, state)
+                else:
+                    self._dense_update(p, p.grad, group, state)
+
+        return loss
+
+    def _dense_update(self, p, grad, group, state):
+        alpha = group['alpha']
+        if group['weight_decay'] != 0:
+            grad = grad.add(p, alpha=group['weight_decay'])
+
+        square_avg = state['square_avg']
+        square_avg.mul_(alpha).addcmul_(grad, grad, value=1 - alpha)
+
+        if group['centered']:
+            grad_avg = state['grad_avg']
+            grad_avg.mul_(alpha).add_(grad, alpha=1 - alpha)
+            avg = square_avg.addcmul(grad_avg, grad_avg, value=-1).sqrt_().add_(group['eps'])
+        else:
+            avg = square_avg.sqrt().add_(group['eps'])
+
+        if group['momentum'] > 0:
+            buf = state['momentum_buffer']
+            buf.mul_(group['momentum']).addcdiv_(grad, avg)
+            p.add_(buf, alpha=-group['lr'])
+        else:
+            p.addcdiv_(grad, avg, value=-group['lr'])
+
+    def _sparse_update(self, p, grad, group, state):
+        alpha = group['alpha']
+        rows = grad._indices()[0]
+        grad = grad._values()
+        if group['weight_decay'] != 0:
+            grad = grad.add(p[rows], alpha=group['weight_decay'])
+
+        square_avg = state['square_avg'][rows].mul_(alpha).addcmul_(grad, grad, value=1 - alpha)
+        state['square_avg'].index_copy_(0, rows, square_avg)
+
+        if group['centered']:
+            grad_avg = state['grad_avg'][rows].mul_(alpha).add_(grad, alpha=1 - alpha)
+            state['grad_avg'].index_copy_(0, rows, grad_avg)
+            avg = square_avg.addcmul(grad_avg, grad_avg, value=-1).sqrt_().add_(group['eps'])
+        else:
+            avg = square_avg.sqrt().add_(group['eps'])
+
+        if group['momentum'] > 0:
+            buf = state['momentum_buffer'][rows].mul_(group['momentum']).addcdiv_(grad, avg)
+            state['momentum_buffer'].index_copy_(0, rows, buf)
+            p.index_add_(0, rows, buf * -group['lr'])
+        else:
+            p.index_add_(0, rows, grad / avg * -group['lr'])
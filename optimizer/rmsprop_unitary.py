@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import torch
 from torch.optim.optimizer import Optimizer, required
-import numpy as np
+from .manifold import cayley_step, foreach_cayley_step, is_unitary, manifold_update
 
 
 class RMSprop_Unitary(Optimizer):
@@ -23,13 +23,29 @@ class RMSprop_Unitary(Optimizer):
 
         .. math::
                   A = G^H*W - W^H*G \\
-                  W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
+                  W_new = W*(I+lr/2 * A)*(I-lr/2 * A)^(-1)
 
         where W, G and lr denote the parameters, gradient
         and learning rate respectively.
+
+        With foreach=True the parameters of a group are stepped together, one
+        batched solve per parameter shape (see manifold.foreach_cayley_step).
+
+        Only unitary parameters take this update: those of groups with
+        unitary=True, or, by default, those tagged p.unitary = True such as
+        the ComplexMeasurement kernels. The other parameters get the update of
+        torch.optim.RMSprop,
+        so one optimizer can train the whole model, see models.get_param_groups.
+
+        With retraction='lazy' the Cayley transform is replaced by the plain
+        step W - lr*(G - W*G^H*W), and W is re-orthonormalized (QR or polar,
+        see orthonormalization) only when its drift ||W*W^H - I||, estimated
+        with drift_probes random probes, exceeds drift_tolerance.
+        manifold.optimizer_drift reports the drift of all unitary parameters.
     """
 
-    def __init__(self, params, lr_unitary=1e-2,  lr=1e-2, alpha=0.99, eps=1e-8, weight_decay=0, momentum=0, centered=False, device = torch.device('cpu')):
+    def __init__(self, params, lr_unitary=1e-2,  lr=1e-2, alpha=0.99, eps=1e-8, weight_decay=0, momentum=0, centered=False, device = torch.device('cpu'), foreach=False, unitary=None,
+                 retraction='cayley', drift_tolerance=1e-3, drift_probes=4, orthonormalization='qr'):
         if not 0.0 <= lr_unitary:
             raise ValueError("Invalid unitary learning rate: {}".format(lr))
         if not 0.0 <= lr:
@@ -42,9 +58,14 @@ class RMSprop_Unitary(Optimizer):
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
         if not 0.0 <= alpha:
             raise ValueError("Invalid alpha value: {}".format(alpha))
+        if retraction not in ('cayley', 'lazy'):
+            raise ValueError("Invalid retraction: {}".format(retraction))
+        if orthonormalization not in ('qr', 'polar'):
+            raise ValueError("Invalid orthonormalization: {}".format(orthonormalization))
 
         self.device = device
-        defaults = dict(lr_unitary=lr_unitary, momentum = momentum, lr=lr, alpha=alpha, eps=eps, centered=centered, weight_decay=weight_decay)
+        defaults = dict(lr_unitary=lr_unitary, momentum = momentum, lr=lr, alpha=alpha, eps=eps, centered=centered, weight_decay=weight_decay, foreach=foreach, unitary=unitary,
+                        retraction=retraction, drift_tolerance=drift_tolerance, drift_probes=drift_probes, orthonormalization=orthonormalization)
         super(RMSprop_Unitary, self).__init__(params, defaults)
 
     def __setstate__(self, state):
@@ -52,7 +73,14 @@ class RMSprop_Unitary(Optimizer):
         for group in self.param_groups:
             group.setdefault('momentum', 0)
             group.setdefault('centered', False)
-
+            group.setdefault('foreach', False)
+            group.setdefault('unitary', None)
+            group.setdefault('retraction', 'cayley')
+            group.setdefault('drift_tolerance', 1e-3)
+            group.setdefault('drift_probes', 4)
+            group.setdefault('orthonormalization', 'qr')
+
+    @torch.no_grad()
     def step(self, closure=None):
         """Performs a single optimization step.
 
@@ -62,9 +90,12 @@ class RMSprop_Unitary(Optimizer):
         """
         loss = None
         if closure is not None:
-            loss = closure()
+            with torch.enable_grad():
+                loss = closure()
 
         for group in self.param_groups:
+            params, d_ps = [], []
+            update = manifold_update(group)
             
             for p in group['params']:
                 if p.grad is None:
@@ -101,39 +132,28 @@ class RMSprop_Unitary(Optimizer):
                 else:
                     avg = square_avg.sqrt().add_(group['eps'])
                 
+                # d_p is the preconditioned gradient, both updates step against it
                 if group['momentum'] >0:
                     buf = state['momentum_buffer']
                     buf.mul_(group['momentum']).addcdiv_(grad, avg)
-                    d_p = torch.add(torch.zeros_like(p.data), -group['lr'], buf)
-#                    p.data.add_(-group['lr'], buf)
+                    d_p = buf
                 else:
-                    d_p = torch.addcdiv(torch.zeros_like(p.data), -group['lr'], grad, avg)
-#                    p.data.addcdiv_(-group['lr'], grad, avg)
-#             
+                    d_p = grad / avg
+
+                if not is_unitary(p, group):
+                    p.add_(d_p, alpha=-group['lr'])
+                    continue
+
                 lr_unitary = group['lr_unitary']
 
-                if  torch.cuda.is_available() :
-                    G = d_p[:,:,0].cpu().numpy()+1j* d_p[:,:,1].cpu().numpy()               
-                    W = p.data[:,:,0].cpu().numpy()+1j* p.data[:,:,1].cpu().numpy()   
+                if group['foreach']:
+                    params.append(p)
+                    d_ps.append(d_p)
                 else:
-                    G = d_p[:,:,0].numpy()+1j* d_p[:,:,1].numpy()               
-                    W = p.data[:,:,0].numpy()+1j* p.data[:,:,1].numpy()  
-
-                #A = G^H W - W^H G
-                A_skew = np.matmul(np.matrix.getH(G),W) - np.matmul(np.matrix.getH(W),G)
-                
-                #(A + i*B)^-1 = (A + B*A^-1*B)^-1 - i*(B + A*B^-1*A)^-1
-                #W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
-                identity = np.eye(A_skew.shape[0])
-                cayley_denom =  np.linalg.inv(identity + (lr_unitary/2)* A_skew)
-                cayley_numer = identity - (lr_unitary/2)* A_skew
-                W_new = np.matmul(np.matmul(cayley_denom,cayley_numer),W)
-                
-                p_new_real = torch.tensor(W_new.real, dtype = torch.float).to(self.device)
-                p_new_imag = torch.tensor(W_new.imag, dtype = torch.float).to(self.device)
-                p_new = torch.cat((p_new_real.unsqueeze(2),p_new_imag.unsqueeze(2)),2)
+                    cayley_step(p, d_p, lr_unitary, update)
 
-                p.data = p_new
+            if params:
+                foreach_cayley_step(params, d_ps, group['lr_unitary'], update)
 
 
         return loss
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import torch
 from torch.optim.optimizer import Optimizer, required
-import numpy as np
+from .manifold import cayley_step, foreach_cayley_step, is_unitary, manifold_update
 
 
 class SGD_Unitary(Optimizer):
@@ -23,14 +23,30 @@ class SGD_Unitary(Optimizer):
 
         .. math::
                   A = G^H*W - W^H*G \\
-                  W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
+                  W_new = W*(I+lr/2 * A)*(I-lr/2 * A)^(-1)
 
         where W, G and lr denote the parameters, gradient
         and learning rate respectively.
+
+        With foreach=True the parameters of a group are stepped together, one
+        batched solve per parameter shape (see manifold.foreach_cayley_step).
+
+        Only unitary parameters take this update: those of groups with
+        unitary=True, or, by default, those tagged p.unitary = True such as
+        the ComplexMeasurement kernels. The other parameters get the update of
+        torch.optim.SGD,
+        so one optimizer can train the whole model, see models.get_param_groups.
+
+        With retraction='lazy' the Cayley transform is replaced by the plain
+        step W - lr*(G - W*G^H*W), and W is re-orthonormalized (QR or polar,
+        see orthonormalization) only when its drift ||W*W^H - I||, estimated
+        with drift_probes random probes, exceeds drift_tolerance.
+        manifold.optimizer_drift reports the drift of all unitary parameters.
     """
 
     def __init__(self, params, lr_unitary=1e-2, lr=required, momentum=0, dampening=0,
-                 weight_decay=0, nesterov=False, device = torch.device('cpu')):
+                 weight_decay=0, nesterov=False, device = torch.device('cpu'), foreach=False, unitary=None,
+                 retraction='cayley', drift_tolerance=1e-3, drift_probes=4, orthonormalization='qr'):
         if not 0.0 <= lr_unitary:
             raise ValueError("Invalid unitary learning rate: {}".format(lr))
         if lr is not required and lr < 0.0:
@@ -39,9 +55,14 @@ class SGD_Unitary(Optimizer):
             raise ValueError("Invalid momentum value: {}".format(momentum))
         if weight_decay < 0.0:
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if retraction not in ('cayley', 'lazy'):
+            raise ValueError("Invalid retraction: {}".format(retraction))
+        if orthonormalization not in ('qr', 'polar'):
+            raise ValueError("Invalid orthonormalization: {}".format(orthonormalization))
 
         defaults = dict(lr_unitary=lr_unitary, lr=lr, momentum=momentum, dampening=dampening,
-                        weight_decay=weight_decay, nesterov=nesterov)
+                        weight_decay=weight_decay, nesterov=nesterov, foreach=foreach, unitary=unitary,
+                        retraction=retraction, drift_tolerance=drift_tolerance, drift_probes=drift_probes, orthonormalization=orthonormalization)
         if nesterov and (momentum <= 0 or dampening != 0):
             raise ValueError("Nesterov momentum requires a momentum and zero dampening")
 
@@ -52,8 +73,15 @@ class SGD_Unitary(Optimizer):
         super(SGD_Unitary, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('nesterov', False)
+            group.setdefault('foreach', False)
+            group.setdefault('unitary', None)
+            group.setdefault('retraction', 'cayley')
+            group.setdefault('drift_tolerance', 1e-3)
+            group.setdefault('drift_probes', 4)
+            group.setdefault('orthonormalization', 'qr')
 
 
+    @torch.no_grad()
     def step(self, closure=None):
         """Performs a single optimization step.
 
@@ -63,13 +91,16 @@ class SGD_Unitary(Optimizer):
         """
         loss = None
         if closure is not None:
-            loss = closure()
+            with torch.enable_grad():
+                loss = closure()
 
         for group in self.param_groups:
             weight_decay = group['weight_decay']
             momentum = group['momentum']
             dampening = group['dampening']
             nesterov = group['nesterov']
+            update = manifold_update(group)
+            params, d_ps = [], []
             
             for p in group['params']:
                 if p.grad is None:
@@ -89,32 +120,21 @@ class SGD_Unitary(Optimizer):
                         d_p = d_p.add(momentum, buf)
                     else:
                         d_p = buf
-                    d_p = torch.add(torch.zeros_like(p.data), -group['lr'], d_p)
-                
+
+                if not is_unitary(p, group):
+                    p.add_(d_p, alpha=-group['lr'])
+                    continue
+
                 lr_unitary = group['lr_unitary']
 
-                if  torch.cuda.is_available() :
-                    G = d_p[:,:,0].cpu().numpy()+1j* d_p[:,:,1].cpu().numpy()               
-                    W = p.data[:,:,0].cpu().numpy()+1j* p.data[:,:,1].cpu().numpy()   
+                if group['foreach']:
+                    params.append(p)
+                    d_ps.append(d_p)
                 else:
-                    G = d_p[:,:,0].numpy()+1j* d_p[:,:,1].numpy()               
-                    W = p.data[:,:,0].numpy()+1j* p.data[:,:,1].numpy()  
-
-                #A = G^H W - W^H G
-                A_skew = np.matmul(np.matrix.getH(G),W) - np.matmul(np.matrix.getH(W),G)
-                
-                #(A + i*B)^-1 = (A + B*A^-1*B)^-1 - i*(B + A*B^-1*A)^-1
-                #W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
-                identity = np.eye(A_skew.shape[0])
-                cayley_denom =  np.linalg.inv(identity + (lr_unitary/2)* A_skew)
-                cayley_numer = identity - (lr_unitary/2)* A_skew
-                W_new = np.matmul(np.matmul(cayley_denom,cayley_numer),W)
-                
-                p_new_real = torch.tensor(W_new.real, dtype = torch.float).to(self.device)
-                p_new_imag = torch.tensor(W_new.imag, dtype = torch.float).to(self.device)
-                p_new = torch.cat((p_new_real.unsqueeze(2),p_new_imag.unsqueeze(2)),2)
-
-                p.data = p_new
+                    cayley_step(p, d_p, lr_unitary, update)
+
+            if params:
+                foreach_cayley_step(params, d_ps, group['lr_unitary'], update)
 
 
         return loss
\ No newline at end of file
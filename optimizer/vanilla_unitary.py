@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import torch
 from torch.optim.optimizer import Optimizer, required
-import numpy as np
+from .manifold import cayley_step, foreach_cayley_step, is_unitary, manifold_update
 
 class Vanilla_Unitary(Optimizer):
     """Implements gradient descent for unitary matrix.
@@ -22,25 +22,52 @@ class Vanilla_Unitary(Optimizer):
 
         .. math::
                   A = G^H*W - W^H*G \\
-                  W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
+                  W_new = W*(I+lr/2 * A)*(I-lr/2 * A)^(-1)
 
         where W, G and lr denote the parameters, gradient
         and learning rate respectively.
+
+        With foreach=True the parameters of a group are stepped together, one
+        batched solve per parameter shape (see manifold.foreach_cayley_step).
+
+        Only unitary parameters take this update: those of groups with
+        unitary=True, or, by default, those tagged p.unitary = True such as
+        the ComplexMeasurement kernels. The other parameters get plain gradient
+        descent with lr,
+        so one optimizer can train the whole model, see models.get_param_groups.
+
+        With retraction='lazy' the Cayley transform is replaced by the plain
+        step W - lr*(G - W*G^H*W), and W is re-orthonormalized (QR or polar,
+        see orthonormalization) only when its drift ||W*W^H - I||, estimated
+        with drift_probes random probes, exceeds drift_tolerance.
+        manifold.optimizer_drift reports the drift of all unitary parameters.
     """
 
-    def __init__(self, params, lr=required, device = torch.device('cpu')):
+    def __init__(self, params, lr=required, device = torch.device('cpu'), foreach=False, unitary=None,
+                 retraction='cayley', drift_tolerance=1e-3, drift_probes=4, orthonormalization='qr'):
         if lr is not required and lr < 0.0:
             raise ValueError("Invalid learning rate: {}".format(lr))
+        if retraction not in ('cayley', 'lazy'):
+            raise ValueError("Invalid retraction: {}".format(retraction))
+        if orthonormalization not in ('qr', 'polar'):
+            raise ValueError("Invalid orthonormalization: {}".format(orthonormalization))
 
         self.device = device
-        defaults = dict(lr=lr)
+        defaults = dict(lr=lr, foreach=foreach, unitary=unitary, retraction=retraction, drift_tolerance=drift_tolerance, drift_probes=drift_probes, orthonormalization=orthonormalization)
         super(Vanilla_Unitary, self).__init__(params, defaults)
 
     def __setstate__(self, state):
         super(Vanilla_Unitary, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('nesterov', False)
-
+            group.setdefault('foreach', False)
+            group.setdefault('unitary', None)
+            group.setdefault('retraction', 'cayley')
+            group.setdefault('drift_tolerance', 1e-3)
+            group.setdefault('drift_probes', 4)
+            group.setdefault('orthonormalization', 'qr')
+
+    @torch.no_grad()
     def step(self, closure=None):
         """Performs a single optimization step.
 
@@ -50,7 +77,8 @@ class Vanilla_Unitary(Optimizer):
         """
         loss = None
         if closure is not None:
-            loss = closure()
+            with torch.enable_grad():
+                loss = closure()
 
         for group in self.param_groups:
 #            weight_decay = group['weight_decay']
@@ -58,6 +86,8 @@ class Vanilla_Unitary(Optimizer):
 #            dampening = group['dampening']
 #            nesterov = group['nesterov']
             lr = group['lr']
+            params, d_ps = [], []
+            update = manifold_update(group)
         
             for p in group['params']:
                 
@@ -67,28 +97,18 @@ class Vanilla_Unitary(Optimizer):
                 
                 d_p = p.grad.data #G
 
-                if  torch.cuda.is_available() :
-                    G = d_p[:,:,0].cpu().numpy()+1j* d_p[:,:,1].cpu().numpy()               
-                    W = p.data[:,:,0].cpu().numpy()+1j* p.data[:,:,1].cpu().numpy()   
-                else:
-                    G = d_p[:,:,0].numpy()+1j* d_p[:,:,1].numpy()               
-                    W = p.data[:,:,0].numpy()+1j* p.data[:,:,1].numpy()  
+                if not is_unitary(p, group):
+                    p.add_(d_p, alpha=-lr)
+                    continue
 
-                #A = G^H W - W^H G
-                A_skew = np.matmul(np.matrix.getH(G),W) - np.matmul(np.matrix.getH(W),G)
-                
-                #(A + i*B)^-1 = (A + B*A^-1*B)^-1 - i*(B + A*B^-1*A)^-1
-                #W_new = (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W
-                identity = np.eye(A_skew.shape[0])
-                cayley_denom =  np.linalg.inv(identity + (lr/2)* A_skew)
-                cayley_numer = identity - (lr/2)* A_skew
-                W_new = np.matmul(np.matmul(cayley_denom,cayley_numer),W)
-                
-                p_new_real = torch.tensor(W_new.real, dtype = torch.float).to(self.device)
-                p_new_imag = torch.tensor(W_new.imag, dtype = torch.float).to(self.device)
-                p_new = torch.cat((p_new_real.unsqueeze(2),p_new_imag.unsqueeze(2)),2)
+                if group['foreach']:
+                    params.append(p)
+                    d_ps.append(d_p)
+                else:
+                    cayley_step(p, d_p, lr, update)
 
-                p.data = p_new
+            if params:
+                foreach_cayley_step(params, d_ps, lr, update)
 
 
         return loss
\ No newline at end of file
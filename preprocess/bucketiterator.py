@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import itertools
 import numpy as np
 import tensorflow as tf
 import torch
@@ -15,10 +16,56 @@ from nltk.corpus import stopwords
 Overlap = 237
 import random
 from units import to_array, pad_sequence
+from preprocess.tokenized_split import TokenizedSplit
 from tools import evaluation
 
+def bucket_batches(lengths, batch_size, shuffle=True, bucket_size=0, max_tokens=0):
+    '''
+    Index batches of the samples with the given lengths. The samples are
+    shuffled, split into mega-batches of bucket_size batches and sorted by
+    length within each mega-batch, so that a batch holds sentences of similar
+    length; the batches are then shuffled. With max_tokens > 0, a batch is
+    closed once its size times its longest length would exceed max_tokens,
+    instead of at batch_size samples. bucket_size = 0 keeps the shuffled order.
+    '''
+    lengths = np.asarray(lengths)
+    indices = np.random.permutation(len(lengths)) if shuffle else np.arange(len(lengths))
+    if bucket_size > 0:
+        mega_batch = batch_size * bucket_size
+        indices = np.concatenate([indices[i:i+mega_batch][np.argsort(lengths[indices[i:i+mega_batch]], kind='stable')]
+                                  for i in range(0, len(indices), mega_batch)] + [indices[:0]])
+
+    if max_tokens > 0:
+        batches = []
+        begin, longest = 0, 0
+        for end in range(len(indices)):
+            longest = max(longest, lengths[indices[end]])
+            if end > begin and longest * (end - begin + 1) > max_tokens:
+                batches.append(indices[begin:end])
+                begin, longest = end, lengths[indices[end]]
+        if begin < len(indices):
+            batches.append(indices[begin:])
+    else:
+        batches = [indices[i:i+batch_size] for i in range(0, len(indices), batch_size)]
+
+    if shuffle and bucket_size > 0:
+        batches = [batches[i] for i in np.random.permutation(len(batches))]
+    return batches
+
 class BucketIterator(object):
-    def __init__(self,data,opt=None,batch_size=2,batch_num = 0, max_sequence_length=0,shuffle=True,test=False,position=False,backend="keras",need_balanced = False,always = False,balance_temperature=1):
+    '''
+    Batches of data = (sequences, labels) or of a TokenizedSplit.
+    bucket_size > 0 groups sentences of similar length into the batches, see
+    bucket_batches, and max_tokens > 0 sizes the batches by a token budget
+    instead of batch_size. dynamic_padding pads each batch to its longest
+    sentence rather than to max_sequence_length.
+    With the torch backend, batches hold integer labels and tensors that share
+    the memory of the padded arrays. Batches of a TokenizedSplit are gathered
+    into num_buffers buffers used in turn, pinned if CUDA is available, so a
+    batch stays valid until num_buffers more batches are drawn; num_buffers = 0
+    allocates every batch.
+    '''
+    def __init__(self,data,opt=None,batch_size=2,batch_num = 0, max_sequence_length=0,shuffle=True,test=False,position=False,backend="keras",need_balanced = False,always = False,balance_temperature=1,bucket_size=0,max_tokens=0,dynamic_padding=False,num_buffers=0):
         self.shuffle=shuffle
         self.data=data
         self.batch_size = batch_size
@@ -30,6 +77,12 @@ class BucketIterator(object):
         self.max_sequence_length = max_sequence_length
         self.need_balanced = need_balanced
         self.balance_temperature=balance_temperature
+        self.bucket_size = bucket_size
+        self.max_tokens = max_tokens
+        self.dynamic_padding = dynamic_padding
+        self.num_buffers = num_buffers
+        self.buffers = [None] * num_buffers
+        self.buffer_index = 0
 
         
         if opt is not None:
@@ -39,6 +92,9 @@ class BucketIterator(object):
         
         self.batch_size=opt.batch_size
         self.shuffle=opt.__dict__.get("shuffle",self.shuffle)
+        self.bucket_size=opt.__dict__.get("bucket_size",self.bucket_size)
+        self.max_tokens=opt.__dict__.get("max_tokens",self.max_tokens)
+        self.dynamic_padding=opt.__dict__.get("dynamic_padding",self.dynamic_padding)
 #        self.position=opt.__dict__.get("position",False)
         self.transform=self.setTransform()
         
@@ -50,12 +106,69 @@ class BucketIterator(object):
         else:
             return  self.transformKeras
             
+    def get_padded_length(self,sequences):
+        # the padded length of a batch, its longest sentence with dynamic_padding
+        if not self.dynamic_padding:
+            return self.max_sequence_length
+        return max(1, min(max(len(s) for s in sequences), self.max_sequence_length))
+
     def transformTorch(self,data):
         
-        padded_sequences = [pad_sequence(s, maxlen = self.max_sequence_length) for s in data[0]]
-        x_data = torch.tensor(padded_sequences)
-        y_data = torch.tensor(data[1])
-        return {'X':x_data, 'y':y_data}
+        sequences = data[0]
+        maxlen = self.get_padded_length(sequences)
+        lengths = np.array([min(len(s), maxlen) for s in sequences], dtype='int64')
+        mask = np.arange(maxlen) < lengths[:, None]
+        x_data = np.zeros((len(sequences), maxlen), dtype='int64')
+        x_data[mask] = np.fromiter(itertools.chain.from_iterable(s[:maxlen] for s in sequences), dtype='int64', count=int(lengths.sum()))
+        # pad id 0 is also a vocabulary id, so the mask comes from the lengths;
+        # an empty sentence keeps one position to avoid an all-masked softmax
+        mask[:, 0] = True
+        y_data = np.asarray(data[1])
+        if y_data.ndim == 2:
+            y_data = y_data.argmax(1)
+        return {'X':torch.from_numpy(x_data), 'y':torch.from_numpy(y_data.astype('int64')), 'mask':torch.from_numpy(mask)}
+
+    def reserve_buffers(self,num_buffers):
+        # keep at least num_buffers in the ring, when a consumer such as a Prefetcher holds several batches
+        if 0 < self.num_buffers < num_buffers:
+            self.buffers.extend([None] * (num_buffers - self.num_buffers))
+            self.num_buffers = num_buffers
+
+    def get_buffers(self,batch_size,maxlen):
+        # token ids, labels and mask of one batch, views of the next buffers of the ring
+        if self.num_buffers == 0:
+            return torch.empty(batch_size, maxlen, dtype=torch.long), torch.empty(batch_size, dtype=torch.long), \
+                torch.empty(batch_size, maxlen, dtype=torch.bool)
+        size = batch_size * maxlen
+        index = self.buffer_index % self.num_buffers
+        self.buffer_index += 1
+        buffers = self.buffers[index]
+        if buffers is None or buffers[0].numel() < size or buffers[1].numel() < batch_size:
+            pin_memory = torch.cuda.is_available()
+            capacity = max(size, self.batch_size * self.max_sequence_length)
+            buffers = (torch.empty(capacity, dtype=torch.long, pin_memory=pin_memory),
+                       torch.empty(max(batch_size, self.batch_size), dtype=torch.long, pin_memory=pin_memory),
+                       torch.empty(capacity, dtype=torch.bool, pin_memory=pin_memory))
+            self.buffers[index] = buffers
+        return buffers[0][:size].view(batch_size, maxlen), buffers[1][:batch_size], buffers[2][:size].view(batch_size, maxlen)
+
+    def collate(self,split,batch):
+        # one gather of the token ids of a TokenizedSplit batch into padded buffers
+        starts = split.offsets[batch]
+        lengths = np.minimum(split.offsets[batch + 1] - starts, self.max_sequence_length)
+        maxlen = max(1, int(lengths.max())) if self.dynamic_padding else self.max_sequence_length
+        x_data, y_data, mask = self.get_buffers(len(batch), maxlen)
+        x, y, m = x_data.numpy(), y_data.numpy(), mask.numpy()
+        positions = np.arange(maxlen)
+        np.less(positions, lengths[:, None], out=m)
+        if len(split.tokens) > 0:
+            np.copyto(x, split.tokens[np.minimum(starts[:, None] + positions, len(split.tokens) - 1)])
+            x *= m
+        else:
+            x.fill(0)
+        m[:, 0] = True
+        np.take(split.labels, batch, out=y)
+        return {'X':x_data, 'y':y_data, 'mask':mask}
     
 #    def transformTorch(self,data):
 #        if torch.cuda.is_available():
@@ -115,27 +228,35 @@ class BucketIterator(object):
         
         return [index_by_list(feature,balance_index) if type(feature) == list  else feature[balance_index] for feature in data]
         
-    def __iter__each(self,data):
-        if (self.shuffle and not self.test) or self.need_balanced:
-            c = list(zip(*data))
-            random.shuffle(c)
-            data = [i for i in zip(*c)]
-        
+    def get_batches(self,num_samples,get_lengths):
+        # index batches of one epoch; get_lengths is only called for bucketing
+        shuffle = (self.shuffle and not self.test) or self.need_balanced
+        if self.bucket_size > 0 or self.max_tokens > 0:
+            lengths = np.clip(get_lengths(), 1, self.max_sequence_length)
+            return bucket_batches(lengths, self.batch_size, shuffle, self.bucket_size, self.max_tokens)
+        indices = np.random.permutation(num_samples) if shuffle else np.arange(num_samples)
         if self.batch_num == 0:
-           
-            batch_num = int(len(data[1])/self.batch_size)
+            batch_num = int(num_samples/self.batch_size)
         else:
             batch_num = self.batch_num
+        batches = [indices[i*self.batch_size:(i+1)*self.batch_size] for i in range(batch_num)]
+        if num_samples%self.batch_size!=0:
+            batches.append(indices[num_samples-self.batch_size:])
+        return batches
 
-       
-        indexes = [(i*self.batch_size,(i+1)*self.batch_size) for i in range(batch_num)]
-        if len(c)%self.batch_size!=0:
-           indexes.append((len(c)-self.batch_size,len(c)))
+    def __iter__each(self,data):
+        if isinstance(data, TokenizedSplit):
+            # a TokenizedSplit is batched by index, its arrays are only gathered from
+            for batch in self.get_batches(len(data), data.lengths):
+                if self.backend == "torch":
+                    yield self.collate(data, batch)
+                else:
+                    maxlen = self.get_padded_length(data.sequences(batch))
+                    yield self.transform([data.to_array(maxlen, batch), data.onehot_labels(batch)])
+            return
 
-        for index in indexes:
-#            yield self.transform([item[index[0]:index[1]] for item in self.data])
-            yield self.transform([item[index[0]:index[1]] for item in data])
-        
+        for batch in self.get_batches(len(data[0]), lambda: [len(s) for s in data[0]]):
+            yield self.transform([[item[i] for i in batch] if isinstance(item, (list, tuple)) else item[batch] for item in data])
 
     def __iter__(self):
         
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import torch
+
+def pin_batch(batch):
+    '''Copy of batch with its tensors in pinned memory, for non-blocking copies to the GPU.'''
+    if torch.is_tensor(batch):
+        return batch if batch.is_pinned() else batch.pin_memory()
+    if isinstance(batch, dict):
+        return {key: pin_batch(value) for key, value in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(pin_batch(value) for value in batch)
+    return batch
+
+class Prefetcher(object):
+    '''
+    Iterates over iterable, e.g. the BucketIterator of DataReader.get_train,
+    while a background thread prepares the next num_batches batches into a
+    bounded queue, so that batch preparation overlaps with the model.
+    An exception of the producer is raised in the consumer, and the thread
+    stops when the iteration ends, fails or is abandoned.
+    pin_memory pins the tensors of each batch if CUDA is available.
+    '''
+    def __init__(self, iterable, num_batches=2, pin_memory=False):
+        self.iterable = iterable
+        self.num_batches = num_batches
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        if hasattr(iterable, 'reserve_buffers'):
+            # the queued batches, the one being produced and the consumed one need their own buffers
+            iterable.reserve_buffers(num_batches + 2)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.num_batches)
+        stop = threading.Event()
+        producer = threading.Thread(target=self.produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                kind, item = batches.get()
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def produce(self, batches, stop):
+        try:
+            for batch in self.iterable:
+                if self.pin_memory:
+                    batch = pin_batch(batch)
+                if not self.put(batches, ('batch', batch), stop):
+                    return
+        except Exception as e:
+            self.put(batches, ('error', e), stop)
+            return
+        self.put(batches, ('end', None), stop)
+
+    def put(self, batches, item, stop):
+        # wait for room in the queue, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
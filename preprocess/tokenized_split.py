@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import itertools
+import numpy as np
+
+def cache_key(*items):
+    '''
+    Short hex digest of the repr of items, used in the file names of the
+    cached splits so that a change of data, preprocessing or dictionary
+    gives new files.
+    '''
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update(repr(item).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+class TokenizedSplit(object):
+    '''
+    A dataset split tokenized once: the token ids of all samples in one flat
+    int32 array, sample i being tokens[offsets[i]:offsets[i+1]], and the
+    integer labels. save() writes one .npy file per array, load() memory-maps
+    them, so batches only slice the arrays.
+    '''
+    array_names = ['tokens', 'offsets', 'labels']
+
+    def __init__(self, tokens, offsets, labels):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.labels = labels
+        # to_categorical infers the number of classes the same way
+        self.num_classes = int(np.max(labels)) + 1 if len(labels) > 0 else 0
+
+    @classmethod
+    def from_sequences(cls, sequences, labels):
+        offsets = np.zeros(len(sequences) + 1, dtype='int64')
+        np.cumsum([len(seq) for seq in sequences], out=offsets[1:])
+        tokens = np.fromiter(itertools.chain.from_iterable(sequences), dtype='int32', count=int(offsets[-1]))
+        return cls(tokens, offsets, np.asarray(labels, dtype='int64'))
+
+    @classmethod
+    def exists(cls, path):
+        return all(os.path.exists('{}.{}.npy'.format(path, name)) for name in cls.array_names)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        return cls(*[np.load('{}.{}.npy'.format(path, name), mmap_mode=mmap_mode) for name in cls.array_names])
+
+    def save(self, path):
+        for name, array in zip(self.array_names, [self.tokens, self.offsets, self.labels]):
+            np.save('{}.{}.npy'.format(path, name), array)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def lengths(self, indices=None):
+        if indices is None:
+            return np.diff(self.offsets)
+        return self.offsets[np.asarray(indices) + 1] - self.offsets[indices]
+
+    def sequences(self, indices=None):
+        '''The token arrays of the samples at indices, slices of tokens.'''
+        if indices is None:
+            indices = range(len(self))
+        return [self.tokens[self.offsets[i]:self.offsets[i+1]] for i in indices]
+
+    def onehot_labels(self, indices=None):
+        '''Labels of the samples at indices, one-hot as keras.utils.to_categorical.'''
+        labels = self.labels if indices is None else self.labels[indices]
+        return np.eye(self.num_classes, dtype='float32')[labels]
+
+    def to_array(self, maxlen=0, indices=None, use_mask=False):
+        '''Zero-padded (n_samples, maxlen) token ids of the samples at indices, as units.to_array.'''
+        starts = self.offsets[:-1] if indices is None else self.offsets[indices]
+        lengths = self.lengths(indices)
+        if maxlen == 0:
+            maxlen = int(lengths.max()) if len(lengths) > 0 else 0
+        mask = np.arange(maxlen) < lengths[:, None]
+        arr = np.zeros((len(starts), maxlen), int)
+        arr[mask] = self.tokens[(starts[:, None] + np.arange(maxlen))[mask]]
+        if use_mask:
+            return arr, mask
+        return arr
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+from preprocess.bucketiterator import bucket_batches
+from preprocess.tokenized_split import TokenizedSplit
+
+def pad_batch(sequences, max_sequence_length, dynamic_padding=False):
+    '''
+    Zero-padded token ids and mask of sequences, as BucketIterator.collate:
+    to max_sequence_length, or to the longest sentence with dynamic_padding.
+    '''
+    lengths = np.array([min(len(s), max_sequence_length) for s in sequences], dtype='int64')
+    maxlen = max(1, int(lengths.max())) if dynamic_padding else max_sequence_length
+    mask = np.arange(maxlen) < lengths[:, None]
+    x_data = np.zeros((len(sequences), maxlen), dtype='int64')
+    if lengths.sum() > 0:
+        x_data[mask] = np.concatenate([np.asarray(s[:maxlen], dtype='int64') for s in sequences])
+    # pad id 0 is also a vocabulary id, so the mask comes from the lengths;
+    # an empty sentence keeps one position to avoid an all-masked softmax
+    mask[:, 0] = True
+    return torch.from_numpy(x_data), torch.from_numpy(mask)
+
+class SplitDataset(Dataset):
+    '''
+    Map-style dataset over a TokenizedSplit of a classification reader, item i
+    being (token ids, label). The split is memory-mapped, so DataLoader worker
+    processes share its arrays rather than copies of the sentences.
+    '''
+    def __init__(self, split):
+        self.split = split
+
+    def __len__(self):
+        return len(self.split)
+
+    def __getitem__(self, i):
+        split = self.split
+        return split.tokens[split.offsets[i]:split.offsets[i+1]], int(split.labels[i])
+
+    def lengths(self):
+        return self.split.lengths()
+
+class QADataset(Dataset):
+    '''
+    Map-style dataset over aligned QA fields, e.g. (questions, answers) or
+    (questions, positive answers, negative answers), each field kept as a
+    TokenizedSplit. Item i is the tuple of the token ids of its fields,
+    followed by its label if labels are given.
+    '''
+    def __init__(self, fields, labels=None):
+        self.fields = fields
+        self.labels = labels
+
+    @classmethod
+    def from_sequences(cls, fields, labels=None):
+        num_samples = len(fields[0])
+        # the labels of the fields are unused, those of the dataset may be missing
+        fields = [TokenizedSplit.from_sequences(sequences, np.zeros(num_samples, dtype='int64')) for sequences in fields]
+        return cls(fields, None if labels is None else np.asarray(labels, dtype='int64'))
+
+    def __len__(self):
+        return len(self.fields[0])
+
+    def __getitem__(self, i):
+        item = tuple(field.tokens[field.offsets[i]:field.offsets[i+1]] for field in self.fields)
+        if self.labels is None:
+            return item
+        return item + (int(self.labels[i]),)
+
+    def lengths(self):
+        # a sample is as long as its longest field
+        return np.max([field.lengths() for field in self.fields], axis=0)
+
+class LengthBucketBatchSampler(Sampler):
+    '''
+    Batch sampler for DataLoader(batch_sampler=...) drawing the index batches of
+    bucket_batches, so that a batch holds samples of similar length. lengths
+    are clipped to max_sequence_length when it is > 0. With max_tokens > 0 the
+    number of batches depends on the order, len() is that of one epoch.
+    '''
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_size=0, max_tokens=0, max_sequence_length=0):
+        lengths = np.asarray(lengths)
+        if max_sequence_length > 0:
+            lengths = np.clip(lengths, 1, max_sequence_length)
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.max_tokens = max_tokens
+
+    def __iter__(self):
+        for batch in bucket_batches(self.lengths, self.batch_size, self.shuffle, self.bucket_size, self.max_tokens):
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.max_tokens > 0:
+            return len(bucket_batches(self.lengths, self.batch_size, self.shuffle, self.bucket_size, self.max_tokens))
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+class ClassificationCollator(object):
+    '''
+    collate_fn of a SplitDataset: a dict batch {'X', 'y', 'mask'} with integer
+    labels, as the torch batches of BucketIterator. A class rather than a
+    closure, so that it can be pickled to DataLoader worker processes.
+    '''
+    def __init__(self, max_sequence_length, dynamic_padding=False):
+        self.max_sequence_length = max_sequence_length
+        self.dynamic_padding = dynamic_padding
+
+    def __call__(self, items):
+        sequences, labels = zip(*items)
+        x_data, mask = pad_batch(sequences, self.max_sequence_length, self.dynamic_padding)
+        return {'X':x_data, 'y':torch.tensor(labels, dtype=torch.long), 'mask':mask}
+
+class QACollator(object):
+    '''
+    collate_fn of a QADataset, giving a dict batch with 'X' and 'mask' lists
+    of one padded tensor per field.
+    Labelled items (question, answer, label) give pointwise batches with
+    integer labels 'y'. Unlabelled triples (question, positive, negative) give
+    pairwise batches X = [q, pos, neg] with match_type 'pairwise', and with
+    'pointwise' the pointwise batch of their positive then negative pairs,
+    labelled 1 and 0 as DataReader.batch_gen.
+    '''
+    def __init__(self, max_sequence_length, match_type='pointwise', dynamic_padding=False):
+        if match_type not in ['pointwise', 'pairwise']:
+            raise ValueError("Invalid match_type: {}".format(match_type))
+        self.max_sequence_length = max_sequence_length
+        self.match_type = match_type
+        self.dynamic_padding = dynamic_padding
+
+    def pad(self, fields):
+        padded = [pad_batch(sequences, self.max_sequence_length, self.dynamic_padding) for sequences in fields]
+        return [x_data for x_data, mask in padded], [mask for x_data, mask in padded]
+
+    def __call__(self, items):
+        fields = list(zip(*items))
+        if isinstance(fields[-1][0], int):
+            x_data, mask = self.pad(fields[:-1])
+            return {'X':x_data, 'y':torch.tensor(fields[-1], dtype=torch.long), 'mask':mask}
+        if self.match_type == 'pairwise':
+            x_data, mask = self.pad(fields)
+            return {'X':x_data, 'mask':mask}
+        q, pos, neg = fields
+        x_data, mask = self.pad([q + q, pos + neg])
+        y_data = torch.cat([torch.ones(len(q), dtype=torch.long), torch.zeros(len(q), dtype=torch.long)])
+        return {'X':x_data, 'y':y_data, 'mask':mask}
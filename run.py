@@ -6,33 +6,45 @@ import numpy as np
 import torch
 import torch.nn as nn
 import models
+from optimizer.manifold import optimizer_drift
+from preprocess.prefetcher import Prefetcher
 
 def run(params):
     model = models.setup(params)
     model = model.to(params.device)
     criterion = nn.CrossEntropyLoss()
-    
-    optimizer = torch.optim.RMSprop(list(model.parameters()), lr=params.lr)
+    optimizer = models.setup_optimizer(params, model)
+    # skip padded positions; models.setup rejects the models whose forward takes no mask
+    padding_mask = params.__dict__.get('padding_mask', False)
+    unitary_update = params.__dict__.get('unitary_update', False)
+    prefetch_batches = params.__dict__.get('prefetch_batches', 0)
+    def batches(iterator):
+        if prefetch_batches > 0:
+            return Prefetcher(iterator, prefetch_batches, pin_memory=True)
+        return iterator
 
     max_test_acc = 0.
     for i in range(params.epochs):
         print('epoch: ', i)
         train_accs = []
         train_losses = []
-        for _i, sample_batched in enumerate(params.reader.get_train(iterable = True)):
+        for _i, sample_batched in enumerate(batches(params.reader.get_train(iterable = True))):
             model.train()
             optimizer.zero_grad()
             inputs = sample_batched['X'].to(params.device)
             targets = sample_batched['y'].to(params.device)
             if params.strategy == 'multi-task':
                 senti_loss, outputs = model(inputs)
-                loss = criterion(outputs, targets.argmax(1)) + params.gamma*senti_loss
+                loss = criterion(outputs, targets) + params.gamma*senti_loss
             else:
-                outputs = model(inputs)
-                loss = criterion(outputs, targets.argmax(1))
+                if padding_mask:
+                    outputs = model(inputs, mask=sample_batched['mask'].to(params.device))
+                else:
+                    outputs = model(inputs)
+                loss = criterion(outputs, targets)
             loss.backward()
             optimizer.step()
-            n_correct = (outputs.argmax(1) == targets.argmax(1)).sum().item()
+            n_correct = (outputs.argmax(1) == targets).sum().item()
             n_total = len(outputs)
             train_acc = n_correct / n_total
             train_accs.append(train_acc)
@@ -48,7 +60,7 @@ def run(params):
                 t_n_total = 0
                 senti_acc = 0
                 cnt = 0
-                for t_sample_batched in params.reader.get_test(iterable = True):
+                for t_sample_batched in batches(params.reader.get_test(iterable = True)):
                     t_inputs = t_sample_batched['X'].to(params.device)
                     t_targets = t_sample_batched['y'].to(params.device)
                     cnt += 1
@@ -56,9 +68,11 @@ def run(params):
                         if params.strategy == 'multi-task':
                             senti_acc_, t_outputs = model(t_inputs)
                             senti_acc += senti_acc_.item()
+                        elif padding_mask:
+                            t_outputs = model(t_inputs, mask=t_sample_batched['mask'].to(params.device))
                         else:
                             t_outputs = model(t_inputs)
-                        t_n_correct += (t_outputs.argmax(1) == t_targets.argmax(1)).sum().item()
+                        t_n_correct += (t_outputs.argmax(1) == t_targets).sum().item()
                         t_n_total += len(t_outputs)
                         
                 test_acc = t_n_correct / t_n_total
@@ -66,6 +80,9 @@ def run(params):
                 if test_acc > max_test_acc:
                     max_test_acc = test_acc
                 print('average_train_acc: {}, average_train_loss: {}, test_acc: {}, senti_acc: {}'.format(avg_train_acc, avg_train_loss, test_acc, senti_acc))
+                if unitary_update:
+                    # distance of the measurement kernels from the unitary manifold
+                    print('orthogonality_drift: {}'.format(optimizer_drift(optimizer)))
     
     embedding_layer = None
     if params.network_type == 'fasttext':
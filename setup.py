@@ -21,7 +21,7 @@ setup(
               'nltk>=3.3',
               'tensorflow>=1.12.0',
               'keras>=2.2.4',
-              'torch>=1.0.0',
+              'torch>=1.8.0',
               'torchvision>=0.2.1',
               'sklearn',
               'keras-bert',
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import time
+import torch
+import torch.nn as nn
+import dataset
+import models
+from params import Params
+from optimizer import RMSprop_Unitary, Adam_Unitary
+
+# both optimizers take the lr and lr_unitary of the config, so that only the update rule differs
+def rmsprop_optimizers(model, params):
+    return [RMSprop_Unitary(models.get_param_groups(model), lr_unitary=params.lr_unitary, lr=params.lr)]
+
+def adam_optimizers(model, params):
+    return [Adam_Unitary(models.get_param_groups(model), lr_unitary=params.lr_unitary, lr=params.lr)]
+
+def evaluate(model, params):
+    model.eval()
+    n_correct, n_total = 0, 0
+    with torch.no_grad():
+        for sample_batched in params.reader.get_test(iterable = True):
+            outputs = model(sample_batched['X'].to(params.device))
+            n_correct += (outputs.argmax(1) == sample_batched['y'].to(params.device)).sum().item()
+            n_total += len(outputs)
+    return n_correct / n_total
+
+def time_to_accuracy(params, build_optimizers, target_acc, max_epochs, eval_every=50):
+    """Training seconds until the test accuracy reaches target_acc, None if it does not."""
+    torch.manual_seed(params.seed)
+    model = models.setup(params).to(params.device)
+    optimizers = build_optimizers(model, params)
+    criterion = nn.CrossEntropyLoss()
+    elapsed = 0.
+    for epoch in range(max_epochs):
+        for i, sample_batched in enumerate(params.reader.get_train(iterable = True)):
+            start = time.time()
+            model.train()
+            for optimizer in optimizers:
+                optimizer.zero_grad()
+            outputs = model(sample_batched['X'].to(params.device))
+            loss = criterion(outputs, sample_batched['y'].to(params.device))
+            loss.backward()
+            for optimizer in optimizers:
+                optimizer.step()
+            elapsed += time.time() - start
+            if i % eval_every == 0:
+                test_acc = evaluate(model, params)
+                if test_acc >= target_acc:
+                    return elapsed, epoch, test_acc
+    return None, max_epochs, test_acc
+
+if __name__ == '__main__':
+    params = Params()
+    params.parse_config('config/config_qdnn.ini')
+    params.reader = dataset.setup(params)
+    params.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    target_acc, max_epochs = 0.78, 10
+    for name, build_optimizers in [('RMSprop_Unitary', rmsprop_optimizers), ('Adam_Unitary', adam_optimizers)]:
+        elapsed, epoch, test_acc = time_to_accuracy(params, build_optimizers, target_acc, max_epochs)
+        if elapsed is None:
+            print('{}: test_acc {:.4f} after {} epochs, target {} not reached'.format(name, test_acc, epoch, target_acc))
+        else:
+            print('{}: test_acc {:.4f} >= {} after {:.1f} s of training, epoch {}'.format(name, test_acc, target_acc, elapsed, epoch))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+import torch
+from preprocess.bucketiterator import BucketIterator
+from preprocess.tokenized_split import TokenizedSplit
+from models.classification.QDNN import QDNN
+from test.benchmark_complex_backend import get_params
+
+def epoch(model, iterator, max_batches):
+    padded_tokens, real_tokens = 0, 0
+    start = time.time()
+    for i, sample_batched in enumerate(iterator):
+        if i == max_batches:
+            break
+        model.zero_grad()
+        outputs = model(sample_batched['X'], mask=sample_batched['mask'])
+        loss = torch.nn.functional.cross_entropy(outputs, sample_batched['y'])
+        loss.backward()
+        padded_tokens += sample_batched['X'].numel()
+        real_tokens += sample_batched['mask'].sum().item()
+    return time.time() - start, padded_tokens, real_tokens
+
+if __name__ == '__main__':
+    # SST-like lengths: mostly short sentences, a long tail up to max_sequence_length
+    num_samples, max_sequence_length, batch_size, max_batches = 6000, 56, 32, 100
+    lengths = np.clip(np.random.lognormal(2.8, 0.5, num_samples).astype(int), 1, max_sequence_length)
+    sequences = [np.random.randint(1, 5000, length) for length in lengths]
+    split = TokenizedSplit.from_sequences(sequences, np.random.randint(0, 2, num_samples))
+    model = QDNN(get_params(False))
+    model.measurement.kernel.data = model.measurement.kernel.data.cpu()
+    for name, options in [('fixed padding', {}),
+                          ('dynamic padding', {'dynamic_padding': True}),
+                          ('buckets', {'dynamic_padding': True, 'bucket_size': 50}),
+                          ('buckets + token budget', {'dynamic_padding': True, 'bucket_size': 50, 'max_tokens': batch_size*20})]:
+        iterator = BucketIterator(split, batch_size=batch_size, max_sequence_length=max_sequence_length, backend='torch', **options)
+        elapsed, padded_tokens, real_tokens = epoch(model, iterator, max_batches)
+        print('{}: {:.2f} s for {} batches, {:.1f}% of the padded tokens are real, {:.0f} real tokens/s'.format(
+                name, elapsed, max_batches, 100.*real_tokens/padded_tokens, real_tokens/elapsed))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+import numpy as np
+import torch
+from preprocess.bucketiterator import BucketIterator
+from preprocess.tokenized_split import TokenizedSplit
+from units import pad_sequence
+
+def legacy_batches(data, batch_size, max_sequence_length):
+    # the shuffle and transformTorch of BucketIterator before index batching
+    c = list(zip(*data))
+    random.shuffle(c)
+    data = [i for i in zip(*c)]
+    for begin in range(0, len(c) - batch_size + 1, batch_size):
+        sequences, labels = data[0][begin:begin+batch_size], data[1][begin:begin+batch_size]
+        x_data = torch.tensor([pad_sequence(s, maxlen = max_sequence_length) for s in sequences])
+        y_data = torch.tensor(labels)
+        lengths = torch.tensor([max(1, min(len(s), max_sequence_length)) for s in sequences])
+        mask = torch.arange(max_sequence_length).unsqueeze(0) < lengths.unsqueeze(1)
+        yield {'X':x_data, 'y':y_data, 'mask':mask}
+
+def batches_per_second(batches):
+    start = time.time()
+    num_batches = 0
+    for sample_batched in batches:
+        num_batches += 1
+    return num_batches / (time.time() - start)
+
+if __name__ == '__main__':
+    num_samples, max_sequence_length, batch_size = 50000, 56, 32
+    lengths = np.clip(np.random.lognormal(2.8, 0.5, num_samples).astype(int), 1, max_sequence_length)
+    sequences = [list(np.random.randint(1, 5000, length)) for length in lengths]
+    labels = np.random.randint(0, 2, num_samples)
+    onehot_labels = np.eye(2, dtype='float32')[labels]
+    split = TokenizedSplit.from_sequences(sequences, labels)
+
+    legacy = batches_per_second(legacy_batches((sequences, onehot_labels), batch_size, max_sequence_length))
+    print('legacy lists: {:.0f} batches/s'.format(legacy))
+    for name, data, options in [('lists', (sequences, onehot_labels), {}),
+                                ('TokenizedSplit', split, {}),
+                                ('TokenizedSplit, ring buffers', split, {'num_buffers': 2})]:
+        iterator = BucketIterator(data, batch_size=batch_size, max_sequence_length=max_sequence_length, backend='torch', **options)
+        rate = batches_per_second(iterator)
+        print('{}: {:.0f} batches/s, speedup {:.1f}x'.format(name, rate, rate/legacy))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+import torch
+from params import Params
+from models.classification.QDNN import QDNN
+from models.classification.LocalMixtureNN import LocalMixtureNN
+
+def get_params(complex_backend, vocab_size=5000, embed_dim=50):
+    opt = Params()
+    opt.max_sequence_length = 50
+    opt.device = torch.device('cpu')
+    opt.sentiment_dic = None
+    opt.measurement_size = 20
+    opt.lookup_table = np.random.randn(vocab_size, embed_dim)
+    opt.use_lexicon_as_measurement = False
+    opt.ngram_value = '1,2,3,4'
+    opt.pooling_type = 'max'
+    opt.hidden_units = 50
+    opt.complex_backend = complex_backend
+    return opt
+
+def benchmark(model, input_seq, targets, repeats):
+    def step():
+        model.zero_grad()
+        loss = torch.nn.functional.cross_entropy(model(input_seq), targets)
+        loss.backward()
+    step()
+    start = time.time()
+    for _ in range(repeats):
+        step()
+    return (time.time() - start) / repeats
+
+if __name__ == '__main__':
+    batch_size, seq_len, repeats = 32, 50, 10
+    input_seq = torch.randint(1, 5000, (batch_size, seq_len))
+    targets = torch.randint(0, 2, (batch_size,))
+    for name, model_class in [('QDNN', QDNN), ('LocalMixtureNN', LocalMixtureNN)]:
+        torch.manual_seed(0)
+        list_model = model_class(get_params(False))
+        torch.manual_seed(0)
+        complex_model = model_class(get_params(True))
+        complex_model.load_state_dict(list_model.state_dict())
+        for model in [list_model, complex_model]:
+            model.measurement.kernel.data = model.measurement.kernel.data.cpu()
+        with torch.no_grad():
+            assert torch.allclose(list_model(input_seq), complex_model(input_seq), atol=1e-4)
+        list_time = benchmark(list_model, input_seq, targets, repeats)
+        complex_time = benchmark(complex_model, input_seq, targets, repeats)
+        print('{}: [real, imag] {:.1f} ms, complex64 {:.1f} ms per training step, speedup {:.2f}x'.format(
+                name, list_time*1000, complex_time*1000, list_time/complex_time))
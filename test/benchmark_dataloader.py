@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from torch.utils.data import DataLoader
+from preprocess.bucketiterator import BucketIterator
+from preprocess.tokenized_split import TokenizedSplit
+from preprocess.torch_dataset import SplitDataset, LengthBucketBatchSampler, ClassificationCollator
+from test.benchmark_collation import batches_per_second
+
+if __name__ == '__main__':
+    num_samples, max_sequence_length, batch_size = 50000, 56, 32
+    lengths = np.clip(np.random.lognormal(2.8, 0.5, num_samples).astype(int), 1, max_sequence_length)
+    split = TokenizedSplit.from_sequences([np.random.randint(1, 5000, length) for length in lengths],
+                                          np.random.randint(0, 2, num_samples))
+
+    iterator = BucketIterator(split, batch_size=batch_size, max_sequence_length=max_sequence_length, backend='torch', bucket_size=50)
+    print('BucketIterator: {:.0f} batches/s'.format(batches_per_second(iterator)))
+    dataset = SplitDataset(split)
+    for num_workers in [0, 2, 4]:
+        sampler = LengthBucketBatchSampler(dataset.lengths(), batch_size, bucket_size=50, max_sequence_length=max_sequence_length)
+        loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=ClassificationCollator(max_sequence_length),
+                            num_workers=num_workers, persistent_workers=num_workers > 0)
+        # the first epoch starts the workers
+        batches_per_second(loader)
+        print('DataLoader, {} workers: {:.0f} batches/s'.format(num_workers, batches_per_second(loader)))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import time
+import torch
+from torch.autograd import profiler
+from layers.complexnn import ComplexDense
+
+def benchmark(dense, inputs, repeats):
+    def step():
+        dense.zero_grad()
+        output = dense(inputs)
+        (output[0].sum() + output[1].sum()).backward()
+    step()
+    if inputs[0].is_cuda:
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        step()
+    if inputs[0].is_cuda:
+        torch.cuda.synchronize()
+    elapsed = (time.time() - start) / repeats
+    with profiler.profile(profile_memory=True, use_cuda=inputs[0].is_cuda) as prof:
+        step()
+    if inputs[0].is_cuda:
+        allocated = sum(e.self_cuda_memory_usage for e in prof.function_events if e.self_cuda_memory_usage > 0)
+    else:
+        allocated = sum(e.self_cpu_memory_usage for e in prof.function_events if e.self_cpu_memory_usage > 0)
+    return elapsed, allocated
+
+if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    batch_size, repeats = 128, 20
+    for in_features, out_features in [(50, 50), (300, 300), (1024, 1024)]:
+        inputs = [torch.randn(batch_size, in_features).to(device), torch.randn(batch_size, in_features).to(device)]
+        dense = ComplexDense(in_features, out_features).to(device)
+        expected = dense(inputs)
+        for mode in ['block', 'cached', 'gauss']:
+            dense.mode = mode
+            output = dense(inputs)
+            assert all(torch.allclose(o, e, atol=1e-3) for o, e in zip(output, expected))
+            elapsed, allocated = benchmark(dense, inputs, repeats)
+            print('{} x {} {}: {:.3f} ms, {:.2f} MB allocated per step'.format(
+                    in_features, out_features, mode, elapsed*1000, allocated/2**20))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+import torch
+from layers.complexnn import NGram
+
+def loop_ngram(inputs, gram_n, dim=1, device=torch.device('cpu')):
+    # NGram.forward before it was rewritten with unfold
+    batch_size, seq_len, embed_dim = inputs.shape
+    total_padded_len = gram_n - 1
+    left_padded_len = int(total_padded_len/2)
+    right_padded_len = total_padded_len - left_padded_len
+    left_padded_zeros = torch.zeros(batch_size, left_padded_len, embed_dim).to(device)
+    right_padded_zeros = torch.zeros(batch_size, right_padded_len, embed_dim).to(device)
+    inputs = torch.cat([left_padded_zeros, inputs, right_padded_zeros], dim=dim)
+    list_of_ngrams = []
+    for i in range(seq_len):
+        slice_index = torch.tensor(np.arange(i, i + gram_n), dtype=torch.long).to(device)
+        l = torch.index_select(inputs, dim, index=slice_index)
+        list_of_ngrams.append(torch.unsqueeze(l, dim=dim+1))
+    return torch.cat(list_of_ngrams, dim=dim+1)
+
+def benchmark(func, inputs, repeats):
+    func(inputs)
+    if inputs.is_cuda:
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        func(inputs)
+    if inputs.is_cuda:
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeats
+
+if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    batch_size, seq_len, embed_dim, repeats = 32, 50, 300, 20
+    inputs = torch.randn(batch_size, seq_len, embed_dim).to(device)
+    for gram_n in [1, 2, 3, 4]:
+        n_gram = NGram(gram_n=gram_n, device=device)
+        assert torch.equal(n_gram(inputs), loop_ngram(inputs, gram_n, device=device))
+        loop_time = benchmark(lambda x: loop_ngram(x, gram_n, device=device), inputs, repeats)
+        unfold_time = benchmark(n_gram, inputs, repeats)
+        print('gram_n = {}: loop {:.3f} ms, unfold {:.3f} ms, speedup {:.1f}x'.format(
+                gram_n, loop_time*1000, unfold_time*1000, loop_time/unfold_time))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import functools
+import time
+import numpy as np
+import torch
+from optimizer.manifold import cayley_step, lowrank_cayley_step, foreach_cayley_step, \
+    cayley_update, lazy_update, orthogonality_drift
+
+def legacy_cayley_step(p, d_p, lr):
+    # the NumPy update the unitary optimizers used before optimizer.manifold,
+    # left-multiplied (I+lr/2 * A)^(-1)*(I-lr/2 * A)*W, which is not a descent step
+    G = d_p[:,:,0].cpu().numpy()+1j* d_p[:,:,1].cpu().numpy()
+    W = p.data[:,:,0].cpu().numpy()+1j* p.data[:,:,1].cpu().numpy()
+    A_skew = np.matmul(np.matrix.getH(G),W) - np.matmul(np.matrix.getH(W),G)
+    identity = np.eye(A_skew.shape[0])
+    cayley_denom =  np.linalg.inv(identity + (lr/2)* A_skew)
+    cayley_numer = identity - (lr/2)* A_skew
+    W_new = np.matmul(np.matmul(cayley_denom,cayley_numer),W)
+    p_new_real = torch.tensor(W_new.real, dtype = torch.float).to(p.device)
+    p_new_imag = torch.tensor(W_new.imag, dtype = torch.float).to(p.device)
+    p.data = torch.cat((p_new_real.unsqueeze(2),p_new_imag.unsqueeze(2)),2)
+
+def dense_row_cayley_step(p, d_p, lr):
+    # W <- W(I+lr/2 * A)(I-lr/2 * A)^(-1) with the dense D x D system
+    W = torch.view_as_complex(p.data)
+    G = torch.view_as_complex(d_p)
+    A_skew = torch.matmul(G.conj().t(), W) - torch.matmul(W.conj().t(), G)
+    identity = torch.eye(A_skew.shape[-1], dtype=A_skew.dtype, device=A_skew.device)
+    X_new = torch.linalg.solve(identity + (lr/2) * A_skew, torch.matmul(identity - (lr/2) * A_skew, W.conj().t()))
+    W.copy_(X_new.conj().t())
+
+def linear_loss(p, d_p):
+    # the loss whose gradient is d_p, which a descent step lowers
+    return torch.sum(p * d_p).item()
+
+def looped_cayley_step(params, d_ps, lr):
+    for p, d_p in zip(params, d_ps):
+        cayley_step(p, d_p, lr)
+
+def benchmark(step, p, d_p, repeats):
+    step(p, d_p, 1e-3)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        step(p, d_p, 1e-3)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeats
+
+if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    repeats = 20
+    for embed_dim in [50, 100, 300]:
+        # a unitary start point, as in ComplexMeasurement(ortho_init=True)
+        kernel = torch.stack([torch.eye(embed_dim), torch.zeros(embed_dim, embed_dim)], dim=-1).to(device)
+        d_p = 0.01 * torch.randn(embed_dim, embed_dim, 2).to(device)
+        legacy_p = torch.nn.Parameter(kernel.clone())
+        torch_p = torch.nn.Parameter(kernel.clone())
+        dense_p = torch.nn.Parameter(kernel.clone())
+        dense_row_cayley_step(dense_p, d_p, 1e-1)
+        cayley_step(torch_p, d_p, 1e-1)
+        assert torch.allclose(dense_p, torch_p, atol=1e-4)
+        assert linear_loss(torch_p, d_p) < linear_loss(kernel, d_p)
+        legacy_time = benchmark(legacy_cayley_step, legacy_p, d_p, repeats)
+        torch_time = benchmark(cayley_step, torch_p, d_p, repeats)
+        print('D = {}: NumPy {:.2f} ms, torch {:.2f} ms per step, speedup {:.1f}x'.format(
+                embed_dim, legacy_time*1000, torch_time*1000, legacy_time/torch_time))
+
+    # K x D measurement kernels, dense D x D solve against the low-rank update taken by cayley_step
+    for embed_dim, units in [(100, 20), (300, 20), (300, 40)]:
+        kernel = torch.stack([torch.eye(units, embed_dim), torch.zeros(units, embed_dim)], dim=-1).to(device)
+        d_p = 0.01 * torch.randn(units, embed_dim, 2).to(device)
+        dense_p = torch.nn.Parameter(kernel.clone())
+        lowrank_p = torch.nn.Parameter(kernel.clone())
+        torch_p = torch.nn.Parameter(kernel.clone())
+        dense_row_cayley_step(dense_p, d_p, 1e-1)
+        lowrank_cayley_step(lowrank_p, d_p, 1e-1)
+        cayley_step(torch_p, d_p, 1e-1)
+        assert torch.allclose(dense_p, lowrank_p, atol=1e-4)
+        assert torch.allclose(dense_p, torch_p, atol=1e-4)
+        assert linear_loss(torch_p, d_p) < linear_loss(kernel, d_p)
+        W = torch.view_as_complex(lowrank_p.data)
+        assert torch.allclose(torch.matmul(W, W.conj().t()), torch.eye(units, dtype=W.dtype, device=device), atol=1e-4)
+        dense_time = benchmark(dense_row_cayley_step, dense_p, d_p, repeats)
+        lowrank_time = benchmark(lowrank_cayley_step, lowrank_p, d_p, repeats)
+        print('D = {}, K = {}: dense {:.2f} ms, low-rank {:.2f} ms per step, speedup {:.1f}x'.format(
+                embed_dim, units, dense_time*1000, lowrank_time*1000, dense_time/lowrank_time))
+
+    # MLLM-like kernels: one K x D kernel per hidden layer plus the final measurement
+    for embed_dim, units, num_layers in [(50, 10, 4), (100, 20, 4), (300, 20, 8)]:
+        kernels = [torch.stack([torch.eye(units, embed_dim), torch.zeros(units, embed_dim)], dim=-1).to(device)
+                   for _ in range(num_layers)]
+        d_ps = [0.01 * torch.randn(units, embed_dim, 2).to(device) for _ in range(num_layers)]
+        looped_ps = [torch.nn.Parameter(kernel.clone()) for kernel in kernels]
+        foreach_ps = [torch.nn.Parameter(kernel.clone()) for kernel in kernels]
+        looped_cayley_step(looped_ps, d_ps, 1e-1)
+        foreach_cayley_step(foreach_ps, d_ps, 1e-1)
+        assert all(torch.allclose(a, b, atol=1e-4) for a, b in zip(looped_ps, foreach_ps))
+        looped_time = benchmark(looped_cayley_step, looped_ps, d_ps, repeats)
+        foreach_time = benchmark(foreach_cayley_step, foreach_ps, d_ps, repeats)
+        print('D = {}, K = {}, {} kernels: looped {:.2f} ms, foreach {:.2f} ms per step, speedup {:.1f}x'.format(
+                embed_dim, units, num_layers, looped_time*1000, foreach_time*1000, looped_time/foreach_time))
+
+    # exact Cayley retraction against lazy steps, with the drift after many steps
+    for embed_dim, units in [(100, 20), (300, 40)]:
+        kernel = torch.stack([torch.eye(units, embed_dim), torch.zeros(units, embed_dim)], dim=-1).to(device)
+        d_p = 0.01 * torch.randn(units, embed_dim, 2).to(device)
+        for name, update in [('cayley', cayley_update),
+                             ('lazy qr', functools.partial(lazy_update, tolerance=1e-3, method='qr')),
+                             ('lazy polar', functools.partial(lazy_update, tolerance=1e-3, method='polar'))]:
+            p = torch.nn.Parameter(kernel.clone())
+            step = functools.partial(cayley_step, update=update)
+            step_time = benchmark(step, p, d_p, 200)
+            W = torch.view_as_complex(p.data)
+            exact_drift = torch.norm(torch.matmul(W, W.conj().t()) - torch.eye(units, dtype=W.dtype, device=device)).item()
+            print('D = {}, K = {}, {}: {:.2f} ms per step, drift {:.2e} (estimate {:.2e})'.format(
+                    embed_dim, units, name, step_time*1000, exact_drift, orthogonality_drift(W, 16).item()))
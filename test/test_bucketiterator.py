@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from preprocess.bucketiterator import BucketIterator
+from preprocess.tokenized_split import TokenizedSplit
+
+def overwritten(iterator, keep):
+    '''Indices of the batches changed after they were yielded, while keep more batches were drawn.'''
+    changed = []
+    kept = []
+    for i, batch in enumerate(iterator):
+        kept.append((i, batch, {key: value.clone() for key, value in batch.items()}))
+        # a batch is checked once keep more batches have been drawn
+        while len(kept) > keep:
+            j, held, copy = kept.pop(0)
+            if any(not held[key].equal(copy[key]) for key in copy):
+                changed.append(j)
+    return changed
+
+def test():
+    num_samples, max_sequence_length, batch_size = 200, 12, 8
+    lengths = np.random.randint(1, max_sequence_length, num_samples)
+    split = TokenizedSplit.from_sequences([np.random.randint(1, 100, length) for length in lengths],
+                                          np.random.randint(0, 2, num_samples))
+    num_batches = num_samples // batch_size
+
+    # without buffers a batch stays valid for the whole epoch
+    iterator = BucketIterator(split, batch_size=batch_size, max_sequence_length=max_sequence_length, backend='torch')
+    assert overwritten(iterator, num_batches) == []
+
+    # a ring of n buffers keeps a batch valid while n - 1 more are drawn, and no longer
+    num_buffers = 3
+    iterator = BucketIterator(split, batch_size=batch_size, max_sequence_length=max_sequence_length, backend='torch',
+                              num_buffers=num_buffers)
+    assert overwritten(iterator, num_buffers - 1) == []
+    assert len(overwritten(iterator, num_buffers)) > 0
+    print('batches are only overwritten once the ring of buffers wraps around')
+
+if __name__ == '__main__':
+    test()
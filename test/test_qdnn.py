@@ -72,11 +72,11 @@ def run_torch(params):
             inputs = sample_batched['X'].long()
             targets = sample_batched['y'].long()
             outputs = model(inputs)
-            loss = criterion(outputs, torch.max(targets, 1)[1])
+            loss = criterion(outputs, targets)
             loss.backward()
             optimizer.step()
 
-            n_correct = (torch.argmax(outputs, -1) == torch.argmax(targets, -1)).sum().item()
+            n_correct = (torch.argmax(outputs, -1) == targets).sum().item()
             n_total = len(outputs)
             train_acc = n_correct / n_total
             print('train_acc: {}, loss: {}'.format(train_acc,loss.item()))
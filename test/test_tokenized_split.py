@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from preprocess.tokenized_split import TokenizedSplit, cache_key
+from units import to_array, pad_sequence
+
+# the dictionary part of the key of DataReader.get_tokenized, printed by a fresh interpreter
+DICTIONARY_KEY = '''
+from dataset.classification.data_reader import DataReader
+from preprocess.tokenized_split import cache_key
+reader = DataReader.__new__(DataReader)
+reader.dataset_name = 'hash_seed'
+corpus = {'X': ['the movie was not bad at all', 'a bad , bad movie', 'all the best actors were there']}
+dictionary = reader.get_dictionary([corpus])
+print(cache_key(sorted(dictionary.items())))
+'''
+
+def dictionary_key(hash_seed):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed), PYTHONPATH=root)
+    # get_dictionary pickles into temp/, keep it out of the repository
+    with tempfile.TemporaryDirectory() as cwd:
+        return subprocess.check_output([sys.executable, '-c', DICTIONARY_KEY], cwd=cwd, env=env).decode().split()[-1]
+
+def test_save_load():
+    sequences = [list(np.random.randint(1, 50, length)) for length in [3, 7, 1, 0, 5]]
+    labels = [0, 2, 1, 1, 0]
+    split = TokenizedSplit.from_sequences(sequences, labels)
+    assert [list(s) for s in split.sequences()] == sequences
+    assert split.num_classes == 3 and list(split.lengths()) == [3, 7, 1, 0, 5]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'split')
+        assert not TokenizedSplit.exists(path)
+        split.save(path)
+        assert TokenizedSplit.exists(path)
+        loaded = TokenizedSplit.load(path)
+        # memory-mapped, not read into memory
+        assert all(isinstance(array, np.memmap) for array in [loaded.tokens, loaded.offsets, loaded.labels])
+        assert [list(s) for s in loaded.sequences()] == sequences
+        assert np.array_equal(loaded.onehot_labels(), np.eye(3, dtype='float32')[labels])
+        del loaded
+
+    # padded as units.to_array, truncated as units.pad_sequence
+    arr, mask = split.to_array(use_mask=True)
+    expected, expected_mask = to_array(sequences, use_mask=True)
+    assert np.array_equal(arr, expected) and np.array_equal(mask, expected_mask)
+    assert np.array_equal(split.to_array(10), to_array(sequences, 10))
+    assert np.array_equal(split.to_array(4), np.stack([pad_sequence(s, 4) for s in sequences]))
+    indices = [4, 1]
+    assert np.array_equal(split.to_array(8, indices), to_array([sequences[i] for i in indices], 8))
+    print('TokenizedSplit round-trips through save/load and pads as units.to_array')
+
+def test_get_tokenized():
+    from dataset.classification.data_reader import DataReader
+    from preprocess.dictionary import Dictionary
+    from preprocess.embedding import Embedding
+
+    def reader(data, options):
+        # the attributes get_tokenized reads, as set by DataReader.__init__
+        reader = DataReader.__new__(DataReader)
+        reader.dataset_name = 'tokenized'
+        reader.data_key = cache_key(data, data, data, options)
+        reader.datas = {'train': data}
+        reader.tokenized = {}
+        reader.dictionary = Dictionary(start_feature_id = 0)
+        for token in ['[UNK]'] + ' '.join(data['X']).split():
+            reader.dictionary.add(token)
+        reader.embedding = Embedding(reader.dictionary, 6)
+        return reader
+
+    data = {'X': ['a good movie', 'not good at all', 'bad'], 'y': [1, 0, 0]}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            split = reader(data, [True]).get_tokenized('train')
+            assert len(os.listdir('temp')) == 3
+            # the same data and options load the saved arrays
+            cached = reader(data, [True]).get_tokenized('train')
+            assert isinstance(cached.tokens, np.memmap)
+            assert np.array_equal(cached.tokens, split.tokens) and np.array_equal(cached.labels, split.labels)
+            assert len(os.listdir('temp')) == 3
+            # other data or preprocessing options get their own arrays
+            reader({'X': data['X'] + ['good'], 'y': data['y'] + [1]}, [True]).get_tokenized('train')
+            reader(data, [False]).get_tokenized('train')
+            assert len(os.listdir('temp')) == 9
+            del cached
+        finally:
+            os.chdir(cwd)
+    print('get_tokenized reuses the cached split, and changes its key with the data and preprocessing')
+
+def test():
+    # the cached splits are only found again if the key survives string hash randomization
+    assert dictionary_key(0) == dictionary_key(1)
+    print('the cache key of the tokenized splits is the same across hash seeds')
+
+if __name__ == '__main__':
+    test_save_load()
+    test_get_tokenized()
+    test()
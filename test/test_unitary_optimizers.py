@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import torch
+from optimizer import SGD_Unitary, RMSprop_Unitary, Vanilla_Unitary, Adam_Unitary
+from optimizer.manifold import cayley_update, dense_cayley_update, lowrank_cayley_update
+from layers.complexnn.measurement import ComplexMeasurement
+
+OPTIMIZERS = [
+    ('Vanilla_Unitary', lambda params, **kwargs: Vanilla_Unitary(params, lr=1e-3, **kwargs)),
+    ('SGD_Unitary', lambda params, **kwargs: SGD_Unitary(params, lr_unitary=1e-3, lr=1e-3, **kwargs)),
+    ('SGD_Unitary momentum', lambda params, **kwargs: SGD_Unitary(params, lr_unitary=1e-3, lr=1e-3, momentum=0.9, **kwargs)),
+    ('RMSprop_Unitary', lambda params, **kwargs: RMSprop_Unitary(params, lr_unitary=1e-3, lr=1e-3, **kwargs)),
+    ('RMSprop_Unitary momentum', lambda params, **kwargs: RMSprop_Unitary(params, lr_unitary=1e-3, lr=1e-3, momentum=0.9, **kwargs)),
+    ('Adam_Unitary', lambda params, **kwargs: Adam_Unitary(params, lr_unitary=1e-3, lr=1e-3, **kwargs)),
+]
+
+def kernel(units, embed_dim, phase):
+    # rows of the identity times phase, 1 or 1j, as (units, embed_dim, 2)
+    W = torch.eye(units, embed_dim, dtype=torch.complex64) * phase
+    return torch.view_as_real(W).clone()
+
+def test_cayley_update():
+    # the low-rank and dense systems give the same step, for single and batched kernels
+    for shape in [(2, 8), (3, 20), (4, 2, 9)]:
+        W = torch.view_as_complex(kernel(shape[-2], shape[-1], 1j)).expand(shape).clone()
+        G = torch.randn(shape, dtype=torch.complex64)
+        lowrank = lowrank_cayley_update(W, G, 1e-1)
+        dense = dense_cayley_update(W, G, 1e-1)
+        assert torch.allclose(lowrank, dense, atol=1e-4), shape
+        assert torch.allclose(cayley_update(W, G, 1e-1), dense, atol=1e-4), shape
+    print('low-rank and dense Cayley updates agree')
+
+def test():
+    torch.manual_seed(0)
+    # square, low-rank (2*units < embed_dim) and dense non-square kernels
+    for units, embed_dim in [(6, 6), (2, 8), (4, 6)]:
+        weight = torch.randn(units, embed_dim, 2)
+        for phase in [1, 1j]:
+            for name, build in OPTIMIZERS:
+                for retraction in ['cayley', 'lazy']:
+                    for foreach in [False, True]:
+                        p = torch.nn.Parameter(kernel(units, embed_dim, phase))
+                        p.unitary = True
+                        optimizer = build([p], retraction=retraction, foreach=foreach)
+                        loss = torch.sum(p * weight)
+                        loss.backward()
+                        optimizer.step()
+                        new_loss = torch.sum(p * weight).item()
+                        assert new_loss < loss.item(), (name, units, embed_dim, phase, retraction, foreach, loss.item(), new_loss)
+                        W = torch.view_as_complex(p.data)
+                        assert torch.allclose(torch.matmul(W, W.conj().t()), torch.eye(units, dtype=W.dtype), atol=1e-3)
+    print('unitary optimizers descend on square and non-square kernels')
+
+def test_eval_after_step():
+    # a step must invalidate the cached projectors, which are keyed on the kernel version
+    torch.manual_seed(0)
+    inputs = [torch.randn(4, 8, 8), torch.zeros(4, 8, 8)]
+    for name, build in OPTIMIZERS:
+        measurement = ComplexMeasurement(8, units=2)
+        measurement.kernel.data = kernel(2, 8, 1)
+        optimizer = build([measurement.kernel])
+        measurement.eval()
+        with torch.no_grad():
+            before = measurement(inputs)
+        measurement.train()
+        loss = torch.sum(measurement(inputs) * torch.randn(4, 2))
+        loss.backward()
+        optimizer.step()
+        measurement.eval()
+        with torch.no_grad():
+            after = measurement(inputs)
+            expected = measurement(inputs, measure_operator=[measurement.kernel[:,:,0], measurement.kernel[:,:,1]])
+        assert not torch.allclose(before, after), name
+        assert torch.allclose(after, expected, atol=1e-5), name
+    print('evaluation after a step uses the stepped kernel')
+
+def test_euclidean_version():
+    # caches such as the cos/sin table of CachedComplexEmbedding key on the version of the weights
+    for name, build in OPTIMIZERS:
+        weight = torch.nn.Parameter(torch.randn(5, 3))
+        optimizer = build([weight])
+        version = weight._version
+        torch.sum(weight * torch.randn(5, 3)).backward()
+        optimizer.step()
+        assert weight._version != version, name
+    print('Euclidean steps bump the version of the parameters')
+
+if __name__ == '__main__':
+    test_cayley_update()
+    test()
+    test_eval_after_step()
+    test_euclidean_version()